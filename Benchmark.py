@@ -0,0 +1,250 @@
+import contextlib
+import subprocess
+import platform
+import numpy as np
+import torch
+import json
+import time
+import sys
+import io
+
+from Engine import Engine
+from games.connect_four import Board
+from games.bit_board import BitBoard
+from agents.mini_max_agent import MiniMaxAgent
+from agents.deep_q_agent import NN
+
+
+# (name, width, height, wins, connect four, moves to set up the position);
+POSITIONS = [
+    ("3x3", 3, 3, 3, False, [[1, 1], [0, 0]]),
+    ("4x4", 4, 4, 4, False, [[1, 1], [2, 2], [0, 3]]),
+    ("7x6_c4", 7, 6, 4, True, [[3, 0], [3, 0], [2, 0], [4, 0]]),
+    ("10x10", 10, 10, 5, False, [[4, 4], [5, 5], [4, 5], [5, 4]]),
+    ("15x15", 15, 15, 5, False, [[7, 7], [8, 8], [7, 8], [8, 7]]),
+]
+
+
+# ------------------------------------------------------------------------------
+def measure(fn, number=1000, repeat=5):
+
+    # the best of a few runs is the least disturbed one; returns seconds per
+    # call;
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+
+    return best / number
+
+
+# ------------------------------------------------------------------------------
+def position(kind, width, height, wins, connect_four, moves, start=0):
+
+    # a started board with both players and the given moves played;
+    board = kind(width, height, wins, connect_four=connect_four)
+    board._verbose = False
+    board.add_player("X")
+    board.add_player("O")
+    board.start_game()
+    board._player_pointer = start
+    for move in moves:
+        board.make_move(move)
+
+    return board
+
+
+# ------------------------------------------------------------------------------
+def half_filled(kind, width, height, wins, connect_four, seed=0):
+
+    # play random moves until about half of the board is used, without ending
+    # the game; the same seed always gives the same position;
+    rng = np.random.RandomState(seed)
+    board = position(kind, width, height, wins, connect_four, [])
+    cols = board._board.shape[1]
+
+    while board._empty > board._state_size // 2:
+        cells = np.flatnonzero(board.possible_mask())
+        cell = cells[rng.randint(0, len(cells))]
+        board.make_move([int(cell % cols), int(cell // cols)])
+        if not board._started:
+            board.undo_move()
+            break
+
+    return board
+
+
+# ------------------------------------------------------------------------------
+def bench_board(number=1000):
+
+    # the hot paths of both board implementations, on half filled boards;
+    results = {}
+
+    for name, width, height, wins, connect_four, _ in POSITIONS:
+        for kind in (Board, BitBoard):
+
+            board = half_filled(kind, width, height, wins, connect_four)
+            move = board.possible_moves()[0]
+
+            def make_move():
+                board.make_move(move)
+                board.undo_move()
+
+            def check_winning_state():
+                board.check_winning_state()
+                board._started = True
+
+            results["%s/%s" % (kind.__name__, name)] = {
+                "make_move": measure(make_move, number),
+                "check_winning_state": measure(check_winning_state, number),
+                "possible_moves": measure(board.possible_moves, number),
+                "c": measure(board.c, number),
+            }
+
+    return results
+
+
+# ------------------------------------------------------------------------------
+def bench_minimax(max_depth=6, search="minimax"):
+
+    # time and nodes to reach every depth on the fixed positions; only the
+    # boards that can be searched that deep in a few seconds are used;
+    results = {}
+
+    for name, width, height, wins, connect_four, moves in POSITIONS[:3]:
+
+        depths = {}
+        for depth in range(2, max_depth + 1):
+
+            board = position(Board, width, height, wins, connect_four, moves)
+            agent = MiniMaxAgent(
+                None,
+                {
+                    "in_place": True,
+                    "max_depth": depth,
+                    "time_limit": float("inf"),
+                    "search": search,
+                },
+            )
+            agent.set_board(board)
+
+            # the agent reports its decisions on stdout;
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                agent.step(board.possible_moves())
+            duration = time.perf_counter() - start
+
+            depths[depth] = {
+                "seconds": duration,
+                "nodes": agent._nodes,
+                "nodes_per_second": agent._nodes / duration,
+                "cutoffs": agent._cutoffs,
+            }
+
+        results[name] = depths
+
+    return results
+
+
+# ------------------------------------------------------------------------------
+def bench_nn(number=1000, batch=256):
+
+    # inference latency of a single state, and per state of a full batch;
+    torch.set_num_threads(1)
+    results = {}
+
+    for name, width, height, wins, connect_four, moves in POSITIONS[:3]:
+
+        board = position(Board, width, height, wins, connect_four, moves)
+        nn = NN(board._state_size, board._action_size, epsilon=0, cols=board._lines._cols)
+        nn.eval()
+        state = board._board.flatten().astype(np.float32)
+        mask = board.possible_mask()
+        states = np.repeat(state[None], batch, axis=0)
+        masks = np.repeat(mask[None], batch, axis=0)
+
+        possible = board.possible_moves()
+
+        results[name] = {
+            "step": measure(lambda: nn.step(state, possible), number),
+            "step_batch_1": measure(lambda: nn.step_batch([state], [mask]), number),
+            "step_batch_%d" % batch: measure(
+                lambda: nn.step_batch(states, masks), max(1, number // 10)
+            )
+            / batch,
+        }
+
+    return results
+
+
+# ------------------------------------------------------------------------------
+def bench_engine(games=1000):
+
+    # complete games per second between two random agents;
+    results = {}
+
+    for name, width, height, wins, connect_four, _ in POSITIONS:
+        for bitboard in (False, True):
+
+            engine = Engine(width, height, wins, connect_four=connect_four, bitboard=bitboard)
+            engine._board._verbose = False
+            engine._infinite = False
+            engine.add_player("X", "random")
+            engine.add_player("O", "random")
+
+            np.random.seed(0)
+            start = time.perf_counter()
+            for _ in range(games):
+                engine.train()
+            duration = time.perf_counter() - start
+
+            kind = "BitBoard" if bitboard else "Board"
+            results["%s/%s" % (kind, name)] = {"games_per_second": games / duration}
+
+    return results
+
+
+# ------------------------------------------------------------------------------
+def revision():
+
+    # the commit the results belong to, if this is a git checkout;
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+# ------------------------------------------------------------------------------
+def run(quick=False):
+
+    number = 100 if quick else 1000
+
+    return {
+        "revision": revision(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "board": bench_board(number),
+        "minimax": bench_minimax(4 if quick else 6),
+        "negamax": bench_minimax(4 if quick else 6, search="negamax"),
+        "nn": bench_nn(number),
+        "engine": bench_engine(number // 10 if quick else number),
+    }
+
+
+# --------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    # python Benchmark.py [output.json] [quick]
+    path = sys.argv[1] if len(sys.argv) > 1 else "./output/benchmark.json"
+    quick = len(sys.argv) > 2 and sys.argv[2] == "quick"
+
+    results = run(quick=quick)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Wrote benchmark results to '%s'." % path)
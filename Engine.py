@@ -1,21 +1,63 @@
+import importlib
 import time
 
 from games.connect_four import Board
-from agents.random_agent import RandomAgent
-from agents.mini_max_agent import MiniMaxAgent
-from agents.deep_q_agent import DeepQAgent
+from games.bit_board import BitBoard
+from games.game_record import GameRecordWriter
 
 
 class Engine:
 
     _infinite = True
     _run_loop = True
-    _players = {}
 
-    # --------------------------------------------------------------------------
-    def __init__(self, width, height, wins, connect_four=False):
+    # agent classes per player type, as (module, class); a module is only
+    # imported once its player type is added, so games without deep-q players
+    # never load torch;
+    _agents = {
+        "minimax": ("agents.mini_max_agent", "MiniMaxAgent"),
+        "deep-q": ("agents.deep_q_agent", "DeepQAgent"),
+        "random": ("agents.random_agent", "RandomAgent"),
+        "mcts": ("agents.mcts_agent", "MCTSAgent"),
+    }
 
-        self._board = Board(width, height, wins, connect_four=connect_four)
+    # --------------------------------------------------------------------------
+    def __init__(
+        self,
+        width,
+        height,
+        wins,
+        connect_four=False,
+        bitboard=False,
+        incremental=False,
+        record=None,
+        record_buffer=16,
+        metrics=None,
+        human=None,
+    ):
+
+        # the bitboard keeps the same interface, but checks wins on integer
+        # masks instead of scanning the numpy board; the incremental mode only
+        # checks the lines through the last move;
+        board = BitBoard if bitboard else Board
+        self._board = board(
+            width, height, wins, connect_four=connect_four, incremental=incremental
+        )
+        self._players = {}
+
+        # finished games are appended to the record file, if one is given; the
+        # writer is opened with the first game, once all players are known; it
+        # keeps a few games in memory, training flushes them when it ends;
+        self._record = record
+        self._record_buffer = record_buffer
+        self._recorder = None
+
+        # per move latencies and agent counters go to a metrics collector;
+        self._metrics = metrics
+
+        # human players ("H") are asked for their moves, by default on the
+        # console;
+        self._human = human if human is not None else self.read_move
 
     # --------------------------------------------------------------------------
     def add_player(self, name, player_type, params={}):
@@ -25,16 +67,34 @@ class Engine:
 
         player = [player_type]
 
-        if player_type == "minimax":
-            player.append(MiniMaxAgent(self, params))
-        elif player_type == "deep-q":
-            player.append(DeepQAgent(self, params))
-        elif player_type == "random":
-            player.append(RandomAgent(self, params))
+        if player_type in self._agents:
+            player.append(self.agent_class(player_type)(self, params))
 
         self._players[name] = player
         self._board.add_player(name)
 
+    # --------------------------------------------------------------------------
+    @classmethod
+    def register(cls, player_type, module, name):
+
+        # make another agent class available, without importing it yet;
+        cls._agents = dict(cls._agents)
+        cls._agents[player_type] = (module, name)
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def agent_class(cls, player_type):
+
+        module, name = cls._agents[player_type]
+        return getattr(importlib.import_module(module), name)
+
+    # --------------------------------------------------------------------------
+    def read_move(self, board, possible):
+
+        # a move as "x y"; connect four only needs the column;
+        op = input("Your move: ").split()
+        return [int(op[0]), int(op[1]) if len(op) > 1 else 0]
+
     # --------------------------------------------------------------------------
     def game_handler(self):
 
@@ -50,15 +110,11 @@ class Engine:
 
                 if self._players[player_name][0] == "H" or self._players[player_name][0] == "":
 
-                    op = "1 2"
-                    op = op.split(" ")
-                    for it in range(len(op)):
-                        op[it] = int(op[it])
-                    print("Player move", op)
-
                     try:
+                        op = self._human(self._board, possible)
+                        print("Player move", op)
                         check = self._board.make_move(op)
-                    except Exception:
+                    except (ValueError, IndexError):
                         print("Invalid input.")
                         check = False
 
@@ -76,24 +132,56 @@ class Engine:
                         success = True
 
                 # print("[NOTIFICATION] Took", time.time() - start, "seconds")
+                if success and self._metrics is not None:
+                    player = self._players[player_name]
+                    stats = player[1].metrics() if len(player) > 1 else {}
+                    self._metrics.move(player_name, player[0], time.time() - start, stats)
 
             # self._board.printBoard()
 
+        if self._metrics is not None and self._board._winner is not None:
+            self._metrics.game(self._board)
+
+        if self._record is not None and self._board._winner is not None:
+            if self._recorder is None:
+                self._recorder = GameRecordWriter(
+                    self._record, self._board, buffer_size=self._record_buffer
+                )
+            self._recorder.write(self._board)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        # write all buffered game records, and shut down the worker processes
+        # of the agents;
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+        for player in self._players.values():
+            if len(player) > 1 and hasattr(player[1], "close"):
+                player[1].close()
+
     # --------------------------------------------------------------------------
     def train(self):
 
-        while True:
+        # an interrupted training run still writes the games it finished;
+        try:
+            while True:
 
-            if self._board.start_game():
-                self.game_handler()
+                if self._board.start_game():
+                    self.game_handler()
 
-            for player in self._players:
-                self._players[player][1].set_board(self._board.c())
-                self._players[player][1].end_game()
+                for player in self._players:
+                    self._players[player][1].set_board(self._board.c())
+                    self._players[player][1].end_game()
 
-            # call the end of game trigger;
-            if not self._infinite:
-                break
+                # call the end of game trigger;
+                if not self._infinite:
+                    break
+        finally:
+            if self._recorder is not None:
+                self._recorder.flush()
 
 
 # --------------------------------------------------------------------------
@@ -102,4 +190,7 @@ if __name__ == "__main__":
     e = Engine(3, 3, 3, connect_four=False)
     e.add_player("X", "deep-q", {"model_name": "1583284745.688666"})
     e.add_player("O", "deep-q")
-    e.train()
+    try:
+        e.train()
+    finally:
+        e.close()
@@ -0,0 +1,181 @@
+import numpy as np
+import json
+import time
+import os
+
+
+class Histogram:
+
+    # all histograms share log scaled buckets, half a decade apart, which fit
+    # latencies down to microseconds as well as node counts into the millions;
+    _bounds = 10.0 ** np.arange(-6, 9.5, 0.5)
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+
+        self._counts = np.zeros(len(self._bounds) + 1, dtype=np.int64)
+        self._count = 0
+        self._sum = 0.0
+        self._min = float("inf")
+        self._max = float("-inf")
+
+    # --------------------------------------------------------------------------
+    def observe(self, value):
+
+        self._counts[np.searchsorted(self._bounds, value)] += 1
+        self._count += 1
+        self._sum += value
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+
+    # --------------------------------------------------------------------------
+    def quantile(self, q):
+
+        # upper bound of the bucket that holds the quantile, within the range
+        # of the observed values;
+        if self._count == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self._counts), q * self._count))
+        if index >= len(self._bounds):
+            return self._max
+        return max(min(float(self._bounds[index]), self._max), self._min)
+
+    # --------------------------------------------------------------------------
+    def summary(self):
+
+        return {
+            "count": self._count,
+            "sum": self._sum,
+            "mean": self._sum / self._count if self._count else None,
+            "min": self._min if self._count else None,
+            "max": self._max if self._count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+
+    # collects the per move statistics of all players of an engine; every
+    # value is kept in a histogram per (player, agent type, name), and every
+    # event can be appended to a JSON lines file as well;
+
+    # --------------------------------------------------------------------------
+    def __init__(self, path=None, prefix="game_ai"):
+
+        self._prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._file = open(path, "a") if path is not None else None
+
+    # --------------------------------------------------------------------------
+    def write(self, event):
+
+        if self._file is not None:
+            self._file.write(json.dumps(event) + "\n")
+
+    # --------------------------------------------------------------------------
+    def observe(self, player, agent, name, value):
+
+        key = (player, agent, name)
+        if key not in self._histograms:
+            self._histograms[key] = Histogram()
+        self._histograms[key].observe(value)
+
+    # --------------------------------------------------------------------------
+    def count(self, name, labels=(), amount=1):
+
+        key = (name,) + tuple(labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    # --------------------------------------------------------------------------
+    def move(self, player, agent, latency, stats):
+
+        # a finished move; stats are the counters the agent reported for it;
+        self.observe(player, agent, "move_seconds", latency)
+        for name, value in stats.items():
+            if value is not None:
+                self.observe(player, agent, name, value)
+        self.count("moves", (player, agent))
+
+        self.write(
+            dict(
+                event="move",
+                time=time.time(),
+                player=player,
+                agent=agent,
+                move_seconds=latency,
+                **stats,
+            )
+        )
+
+    # --------------------------------------------------------------------------
+    def game(self, board):
+
+        winner = board._winner if board._winner else "draw"
+        self.count("games", (winner,))
+        self.write(
+            dict(event="game", time=time.time(), winner=winner, moves=len(board._history))
+        )
+
+    # --------------------------------------------------------------------------
+    def summary(self):
+
+        # {player: {agent: {name: histogram summary}}};
+        result = {}
+        for (player, agent, name), histogram in sorted(self._histograms.items()):
+            result.setdefault(player, {}).setdefault(agent, {})[name] = histogram.summary()
+
+        return result
+
+    # --------------------------------------------------------------------------
+    def prometheus(self):
+
+        # text exposition format; the buckets are cumulative, as in prometheus;
+        lines = []
+        names = sorted(set(name for _, _, name in self._histograms))
+
+        for name in names:
+            metric = "%s_%s" % (self._prefix, name)
+            lines.append("# TYPE %s histogram" % metric)
+
+            for (player, agent, n), histogram in sorted(self._histograms.items()):
+                if n != name:
+                    continue
+                labels = 'player="%s",agent="%s"' % (player, agent)
+                cumulative = np.cumsum(histogram._counts)
+                for bound, count in zip(histogram._bounds, cumulative):
+                    lines.append('%s_bucket{%s,le="%g"} %d' % (metric, labels, bound, count))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (metric, labels, histogram._count))
+                lines.append("%s_sum{%s} %r" % (metric, labels, histogram._sum))
+                lines.append("%s_count{%s} %d" % (metric, labels, histogram._count))
+
+        for key in sorted(set(key[0] for key in self._counters)):
+            metric = "%s_%s_total" % (self._prefix, key)
+            lines.append("# TYPE %s counter" % metric)
+            for labels, count in sorted(self._counters.items()):
+                if labels[0] != key:
+                    continue
+                if key == "games":
+                    text = 'winner="%s"' % labels[1]
+                else:
+                    text = 'player="%s",agent="%s"' % labels[1:]
+                lines.append("%s{%s} %d" % (metric, text, count))
+
+        return "\n".join(lines) + "\n"
+
+    # --------------------------------------------------------------------------
+    def dump(self, path):
+
+        # write the text dump at once, so a scraper never reads half of it;
+        with open(path + ".tmp", "w") as f:
+            f.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,138 @@
+import multiprocessing
+import numpy as np
+import queue
+import torch
+import time
+
+from Engine import Engine
+
+
+# ------------------------------------------------------------------------------
+def _actor(index, config, trajectories, weights, stop):
+
+    # every actor plays its own games with a copy of the learner's network;
+    width, height, wins, connect_four, state_dict, epsilon = config
+    np.random.seed((index * 7919 + int(time.time())) % (2 ** 32))
+    torch.manual_seed(index)
+    torch.set_num_threads(1)
+
+    engine = Engine(width, height, wins, connect_four=connect_four)
+    engine._board._verbose = False
+    engine._infinite = False
+    for name in ("X", "O"):
+        engine.add_player(name, "deep-q", {"trajectories": trajectories})
+    agents = [engine._players[name][1] for name in engine._players]
+
+    latest = (state_dict, epsilon)
+    while not stop.is_set():
+
+        # only the most recent weights matter;
+        try:
+            while True:
+                latest = weights.get_nowait()
+        except queue.Empty:
+            pass
+
+        if latest is not None:
+            for agent in agents:
+                agent._nn.publish(latest[0])
+                agent._nn._epsilon = latest[1]
+            latest = None
+
+        engine.train()
+
+
+class SelfPlay:
+
+    # --------------------------------------------------------------------------
+    def __init__(self, width, height, wins, connect_four=False, actors=2, params={}):
+
+        # the learner is a regular agent of a local engine; it never plays, but
+        # trains on the games of all actors;
+        self._config = (width, height, wins, connect_four)
+        self._actors = actors
+        self._broadcast_every = params.get("broadcast_every", 1)
+
+        self._engine = Engine(width, height, wins, connect_four=connect_four)
+        self._engine._board._verbose = False
+        self._engine.add_player("X", "deep-q", params)
+        self._learner = self._engine._players["X"][1]
+
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = []
+        self._weights = []
+        self._trajectories = None
+        self._stop = None
+        self._games = 0
+
+    # --------------------------------------------------------------------------
+    def start(self):
+
+        nn = self._learner._nn
+        config = self._config + (nn.state_dict(), nn._epsilon)
+
+        self._trajectories = self._context.Queue()
+        self._stop = self._context.Event()
+
+        for index in range(self._actors):
+            weights = self._context.Queue()
+            process = self._context.Process(
+                target=_actor,
+                args=(index, config, self._trajectories, weights, self._stop),
+                daemon=True,
+            )
+            process.start()
+            self._weights.append(weights)
+            self._processes.append(process)
+
+    # --------------------------------------------------------------------------
+    def broadcast(self):
+
+        # send the current weights and exploration rate to every actor;
+        nn = self._learner._nn
+        state_dict = {key: value.clone() for key, value in nn.state_dict().items()}
+        for weights in self._weights:
+            weights.put((state_dict, nn._epsilon))
+
+    # --------------------------------------------------------------------------
+    def run(self, rounds=None):
+
+        # collect games until the learner finished the given amount of training
+        # rounds, or forever;
+        if not self._processes:
+            self.start()
+
+        try:
+            while rounds is None or self._learner._training_count < rounds:
+
+                states, actions, reward = self._trajectories.get()
+                count = self._learner._training_count
+                self._learner.add_game(states, actions, reward)
+                self._games += 1
+
+                if self._learner._training_count != count:
+                    if self._learner._training_count % self._broadcast_every == 0:
+                        self.broadcast()
+        finally:
+            self.stop()
+
+    # --------------------------------------------------------------------------
+    def stop(self):
+
+        if self._stop is not None:
+            self._stop.set()
+
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+        self._processes = []
+        self._weights = []
+
+
+# --------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    s = SelfPlay(3, 3, 3, connect_four=False, actors=4)
+    s.run()
@@ -0,0 +1,452 @@
+import concurrent.futures
+import multiprocessing
+import numpy as np
+import asyncio
+import json
+import time
+import sys
+import os
+
+from Engine import Engine
+from games.connect_four import Board
+
+
+# the agents of a worker process, per board configuration, agent type and the
+# params that shape the agent (and its tables); agents keep their tables between
+# the moves they're asked for; the least recently used ones are dropped, every
+# minimax agent holds a transposition table of its own;
+_agents = {}
+_max_agents = 8
+
+# params that only bound a single search are set on the cached agent for every
+# move, as the attribute they end up in; they aren't part of the cache key;
+_per_move = {
+    "max_depth": "_depth_limit",
+    "playouts": "_playouts",
+    "exploration": "_exploration",
+}
+
+
+# ------------------------------------------------------------------------------
+def _init_worker():
+
+    # agents report their decisions on stdout, nobody reads it in a worker;
+    sys.stdout = open(os.devnull, "w")
+
+
+# ------------------------------------------------------------------------------
+def _agent_move(config, player_type, params, board, time_limit=None):
+
+    # runs in a worker process; returns the move of the agent for the player
+    # to move on the board; timed agents get the time limit for this move;
+    shape = dict((k, v) for k, v in params.items() if k not in _per_move)
+    key = (config, player_type, json.dumps(shape, sort_keys=True))
+
+    entry = _agents.pop(key, None)
+    if entry is None:
+        width, height, wins, connect_four = config
+        engine = Engine(width, height, wins, connect_four=connect_four)
+        engine._board._verbose = False
+        engine.add_player("A", player_type, shape)
+        agent = engine._players["A"][1]
+        defaults = dict(
+            (a, getattr(agent, a)) for a in _per_move.values() if hasattr(agent, a)
+        )
+        entry = (agent, defaults)
+
+    # the cache keeps its entries from the least to the most recently used;
+    _agents[key] = entry
+    while len(_agents) > _max_agents:
+        old = _agents.pop(next(iter(_agents)))[0]
+        if hasattr(old, "close"):
+            old.close()
+
+    agent, defaults = entry
+    for name, attribute in _per_move.items():
+        if attribute in defaults:
+            setattr(agent, attribute, params.get(name, defaults[attribute]))
+
+    agent.set_board(board)
+    if time_limit is None:
+        move = agent.step(board.possible_moves())
+    else:
+        move = agent.step(board.possible_moves(), time_limit=time_limit)
+
+    return [int(move[0]), int(move[1])]
+
+
+class Session:
+
+    # boards are clamped to this size, larger ones take a while to set up and
+    # can't be searched in time anyway;
+    _min_size = 3
+    _max_size = 19
+
+    # the params a client may pass to each agent type, with their types; all
+    # other params (tables, models, training, workers) are up to the server;
+    _allowed = {
+        "minimax": {"in_place": bool, "max_depth": int, "symmetry": bool, "search": str},
+        "mcts": {"playouts": int, "exploration": float},
+        "deep-q": {},
+        "random": {},
+    }
+    _searches = ("minimax", "negamax")
+
+    # the agents that stop searching at a time limit; the others are fast;
+    _timed = ("minimax", "mcts")
+    _max_depth = 16
+    _max_playouts = 100000
+
+    # --------------------------------------------------------------------------
+    def __init__(self, key, request, max_time):
+
+        # a single game between a remote client and an agent; the session only
+        # holds the board, the agent runs on the server's executor; requests
+        # that can't be played raise a ValueError or TypeError;
+        self._key = key
+
+        def clamp(value, low, high):
+            return min(max(int(value), low), high)
+
+        width = clamp(request.get("width", 3), self._min_size, self._max_size)
+        height = clamp(request.get("height", 3), self._min_size, self._max_size)
+        wins = clamp(request.get("wins", 3), self._min_size, max(width, height))
+        self._config = (width, height, wins, bool(request.get("connect_four", False)))
+
+        self._agent = request.get("agent", "minimax")
+        if self._agent not in self._allowed:
+            raise ValueError("Unknown agent '%s'." % self._agent)
+
+        params = request.get("params", {})
+        if not isinstance(params, dict):
+            raise TypeError("Params have to be an object.")
+        allowed = self._allowed[self._agent]
+        self._params = {}
+        for name, value in params.items():
+            if name not in allowed:
+                raise ValueError("Unknown param '%s'." % name)
+            self._params[name] = allowed[name](value)
+        if self._params.get("search", "minimax") not in self._searches:
+            raise ValueError("Unknown search '%s'." % self._params["search"])
+        if "max_depth" in self._params:
+            self._params["max_depth"] = clamp(self._params["max_depth"], 2, self._max_depth)
+        if "playouts" in self._params:
+            self._params["playouts"] = clamp(self._params["playouts"], 1, self._max_playouts)
+
+        # the agent gets at most the time limit of the session per move; it's
+        # passed with every move, agents are shared between sessions;
+        time_limit = float(request.get("time_limit", max_time))
+        if not time_limit > 0:
+            raise ValueError("The time limit has to be positive.")
+        self._time_limit = min(time_limit, max_time)
+        if self._agent == "deep-q":
+            self._params["learn"] = False
+        self._params["workers"] = 1
+
+        width, height, wins, connect_four = self._config
+        self._board = Board(width, height, wins, connect_four=connect_four)
+        self._board._verbose = False
+        self._board.add_player("X")
+        self._board.add_player("O")
+        self._board.start_game()
+
+        # the client plays X; it starts unless it asked otherwise;
+        self._human = "X"
+        self._board._player_pointer = 0 if request.get("first", True) else 1
+        self._last_seen = time.time()
+
+    # --------------------------------------------------------------------------
+    def state(self):
+
+        return {
+            "op": "state",
+            "session": self._key,
+            "board": [[chr(c) if c else "" for c in row] for row in self._board._board.tolist()],
+            "turn": self._board._players[self._board._player_pointer]
+            if self._board._started
+            else None,
+            "you": self._human,
+            "possible": self._board.possible_moves() if self._board._started else [],
+            "winner": None
+            if self._board._winner is None
+            else (self._board._winner or "draw"),
+        }
+
+
+class GameServer:
+
+    # --------------------------------------------------------------------------
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8765,
+        max_sessions=1000,
+        max_pending=64,
+        max_time=5.0,
+        idle_timeout=300.0,
+        workers=None,
+    ):
+
+        self._host = host
+        self._port = port
+
+        # sessions beyond the limit are rejected; agent moves beyond the amount
+        # of pending moves wait for a free slot, and their clients aren't read
+        # from in the meantime;
+        self._max_sessions = max_sessions
+        self._max_time = max_time
+        self._idle_timeout = idle_timeout
+        self._pending = asyncio.Semaphore(max_pending)
+
+        # slow searches run in a process pool, so they never block the loop;
+        # every process runs one search at a time, so its agents are never
+        # shared between sessions; the processes are spawned, forked ones would
+        # hold on to the sockets of the clients;
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+        self._sessions = {}
+        self._clients = set()
+        self._counter = 0
+        self._server = None
+
+    # --------------------------------------------------------------------------
+    async def agent_move(self, session):
+
+        # the agent's move; a move that doesn't come in time (or fails) is
+        # replaced by a random legal one; a late search still runs on in its
+        # worker, so its slot is only given back once it's really done;
+        board = session._board
+        loop = asyncio.get_running_loop()
+
+        await self._pending.acquire()
+        try:
+            future = loop.run_in_executor(
+                self._executor,
+                _agent_move,
+                session._config,
+                session._agent,
+                session._params,
+                board.c(),
+                session._time_limit if session._agent in session._timed else None,
+            )
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+
+        # the future is only waited for, never cancelled;
+        done, _ = await asyncio.wait({future}, timeout=session._time_limit + 1.0)
+        try:
+            if not done:
+                raise Exception("Agent move timed out.")
+            if not board.make_move(future.result()):
+                raise Exception("Illegal agent move.")
+        except Exception:
+            possible = board.possible_moves()
+            board.make_move(possible[np.random.randint(0, len(possible))])
+
+    # --------------------------------------------------------------------------
+    async def play(self, session):
+
+        # let the agent move until it's the client's turn again;
+        while session._board._started and (
+            session._board._players[session._board._player_pointer] != session._human
+        ):
+            await self.agent_move(session)
+
+    # --------------------------------------------------------------------------
+    async def handle_request(self, request, owned):
+
+        op = request.get("op")
+
+        if op == "new":
+            if len(self._sessions) >= self._max_sessions:
+                return {"op": "error", "message": "Too many sessions."}
+            try:
+                session = Session(self._counter + 1, request, self._max_time)
+            except (ValueError, TypeError) as e:
+                return {"op": "error", "message": str(e)}
+            self._counter += 1
+            self._sessions[session._key] = session
+            owned.add(session._key)
+            await self.play(session)
+            return session.state()
+
+        session = self._sessions.get(request.get("session"))
+        if session is None or session._key not in owned:
+            return {"op": "error", "message": "Unknown session."}
+        session._last_seen = time.time()
+
+        if op == "state":
+            return session.state()
+
+        if op == "move":
+            board = session._board
+            if not board._started:
+                return {"op": "error", "message": "Game is over."}
+            if board._players[board._player_pointer] != session._human:
+                return {"op": "error", "message": "Not your turn."}
+            try:
+                legal = board.make_move([int(v) for v in request["move"]])
+            except (KeyError, ValueError, TypeError, IndexError):
+                legal = False
+            if not legal:
+                return {"op": "error", "message": "Illegal move."}
+            await self.play(session)
+            return session.state()
+
+        if op == "close":
+            self._sessions.pop(session._key, None)
+            owned.discard(session._key)
+            return {"op": "closed", "session": session._key}
+
+        return {"op": "error", "message": "Unknown operation."}
+
+    # --------------------------------------------------------------------------
+    async def handle_client(self, reader, writer):
+
+        # one JSON request per line, answered in order; a client can hold many
+        # sessions, all of them are dropped when it disconnects;
+        owned = set()
+        self._clients.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle_request(json.loads(line), owned)
+                except (ValueError, TypeError, AttributeError):
+                    response = {"op": "error", "message": "Invalid request."}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for key in owned:
+                self._sessions.pop(key, None)
+            self._clients.discard(asyncio.current_task())
+            writer.close()
+
+    # --------------------------------------------------------------------------
+    async def expire(self):
+
+        # drop sessions that were idle for too long;
+        while True:
+            await asyncio.sleep(min(self._idle_timeout, 10.0))
+            now = time.time()
+            for key, session in list(self._sessions.items()):
+                if now - session._last_seen > self._idle_timeout:
+                    self._sessions.pop(key, None)
+
+    # --------------------------------------------------------------------------
+    async def start(self):
+
+        self._server = await asyncio.start_server(
+            self.handle_client, self._host, self._port, limit=2 ** 16
+        )
+        self._expire = asyncio.ensure_future(self.expire())
+
+    # --------------------------------------------------------------------------
+    async def serve(self):
+
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    # --------------------------------------------------------------------------
+    async def stop(self):
+
+        # give connected clients a moment to finish their requests;
+        self._expire.cancel()
+        self._server.close()
+        if self._clients:
+            await asyncio.wait(list(self._clients), timeout=1.0)
+        await self._server.wait_closed()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class GameClient:
+
+    # --------------------------------------------------------------------------
+    def __init__(self, host="127.0.0.1", port=8765):
+
+        self._host = host
+        self._port = port
+        self._reader = None
+        self._writer = None
+
+    # --------------------------------------------------------------------------
+    async def connect(self):
+
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+
+    # --------------------------------------------------------------------------
+    async def request(self, **request):
+
+        self._writer.write((json.dumps(request) + "\n").encode())
+        await self._writer.drain()
+        return json.loads(await self._reader.readline())
+
+    # --------------------------------------------------------------------------
+    async def play_random(self, **params):
+
+        # play a whole game with random moves; returns the final state;
+        state = await self.request(op="new", **params)
+        while state["winner"] is None:
+            move = state["possible"][np.random.randint(0, len(state["possible"]))]
+            state = await self.request(op="move", session=state["session"], move=move)
+        await self.request(op="close", session=state["session"])
+
+        return state
+
+    # --------------------------------------------------------------------------
+    async def close(self):
+
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+# ------------------------------------------------------------------------------
+async def _test(games, port, params):
+
+    # start a local server and let many clients play against it at once;
+    server = GameServer(port=port)
+    await server.start()
+
+    async def play():
+        client = GameClient(port=port)
+        await client.connect()
+        state = await client.play_random(**params)
+        await client.close()
+        return state["winner"]
+
+    start = time.time()
+    winners = await asyncio.gather(*[play() for _ in range(games)])
+    duration = time.time() - start
+    await server.stop()
+
+    print(
+        "%d games in %.2f seconds, results: %s"
+        % (games, duration, {w: winners.count(w) for w in set(winners)})
+    )
+
+
+# --------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    # python Server.py serve [port]
+    # python Server.py test [games] [port]
+    mode = sys.argv[1] if len(sys.argv) > 1 else "serve"
+
+    if mode == "test":
+        games = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else 8765
+        asyncio.run(_test(games, port, {"agent": "minimax", "params": {"in_place": True}}))
+    else:
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+        asyncio.run(GameServer(port=port).serve())
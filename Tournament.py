@@ -0,0 +1,250 @@
+import multiprocessing
+import contextlib
+import numpy as np
+import itertools
+import math
+import time
+import io
+
+from Engine import Engine
+
+
+# ------------------------------------------------------------------------------
+def _match(task):
+
+    # play a few games between two roster entries, each of them starting every
+    # other game; returns (wins, draws, losses) of the first entry;
+    config, first, second, games, offset, seed = task
+    width, height, wins, connect_four = config
+    np.random.seed(seed % (2 ** 32))
+
+    engine = Engine(width, height, wins, connect_four=connect_four)
+    engine._board._verbose = False
+
+    # the engine's player names are the board symbols; agents of a pool worker
+    # can't start their own worker processes;
+    for symbol, (_, player_type, params) in zip(("X", "O"), (first, second)):
+        params = dict(params, workers=1)
+        if player_type == "deep-q":
+            params.setdefault("learn", False)
+        engine.add_player(symbol, player_type, params)
+
+    result = [0, 0, 0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for game in range(games):
+
+            engine._board.start_game()
+            engine._board._player_pointer = (offset + game) % 2
+            engine.game_handler()
+
+            for player in engine._players:
+                engine._players[player][1].set_board(engine._board.c())
+                engine._players[player][1].end_game()
+
+            if engine._board._winner == "X":
+                result[0] += 1
+            elif engine._board._winner == "O":
+                result[2] += 1
+            else:
+                result[1] += 1
+
+    engine.close()
+
+    return first[0], second[0], result
+
+
+class Tournament:
+
+    _z = 1.96
+
+    # --------------------------------------------------------------------------
+    def __init__(
+        self, width, height, wins, roster, connect_four=False, workers=None, chunk=10
+    ):
+
+        # the roster is a list of (name, player type, params), just like the
+        # arguments of Engine.add_player;
+        self._config = (width, height, wins, connect_four)
+        self._roster = roster
+        self._names = [entry[0] for entry in roster]
+        self._workers = workers or multiprocessing.cpu_count()
+        self._chunk = chunk
+
+        # results per ordered pair, from the perspective of the first entry;
+        self._results = {}
+        self._ratings = {name: 1500.0 for name in self._names}
+        self._pool = None
+        self._seed = int(time.time())
+
+    # --------------------------------------------------------------------------
+    def tasks(self, pairs, games):
+
+        # split every match into chunks that run in parallel; the offset keeps
+        # the starting player alternating over the whole match;
+        tasks = []
+        entries = dict((entry[0], entry) for entry in self._roster)
+        for a, b in pairs:
+            for offset in range(0, games, self._chunk):
+                self._seed += 1
+                tasks.append(
+                    (
+                        self._config,
+                        entries[a],
+                        entries[b],
+                        min(self._chunk, games - offset),
+                        offset,
+                        self._seed,
+                    )
+                )
+
+        return tasks
+
+    # --------------------------------------------------------------------------
+    def play(self, pairs, games):
+
+        # run all matches on the pool; returns the results of this call only;
+        if self._pool is None:
+            context = multiprocessing.get_context("spawn")
+            self._pool = context.Pool(self._workers)
+
+        played = {}
+        for a, b, (w, d, l) in self._pool.imap_unordered(_match, self.tasks(pairs, games)):
+            for key, result in (((a, b), (w, d, l)), ((b, a), (l, d, w))):
+                for store in (self._results, played):
+                    total = store.get(key, (0, 0, 0))
+                    store[key] = tuple(t + r for t, r in zip(total, result))
+
+        return played
+
+    # --------------------------------------------------------------------------
+    def round_robin(self, games=20):
+
+        # every entry plays every other one;
+        self.play(list(itertools.combinations(self._names, 2)), games)
+        self.update_ratings()
+
+    # --------------------------------------------------------------------------
+    def ladder(self, rounds=5, games=20):
+
+        # every round pairs neighbours of the current rating order, so the
+        # games are spent where the ratings are least certain;
+        for it in range(rounds):
+
+            order = sorted(self._names, key=lambda n: -self._ratings[n])
+            start = it % 2
+            pairs = [
+                (order[i], order[i + 1]) for i in range(start, len(order) - 1, 2)
+            ]
+            if not pairs:
+                pairs = [(order[0], order[1])]
+
+            self.play(pairs, games)
+            self.update_ratings()
+
+    # --------------------------------------------------------------------------
+    def update_ratings(self, iterations=1000, tolerance=1e-3):
+
+        # the elo ratings that explain all results so far best (the maximum
+        # likelihood of the logistic model, draws count half); newton steps per
+        # player until nothing moves anymore; perfect scores are clamped just
+        # like in the intervals, so their ratings stay finite;
+        scale = math.log(10) / 400
+        names = [n for n in self._names if any(a == n for a, _ in self._results)]
+
+        scores = {}
+        for name in names:
+            games = sum(sum(r) for (a, _), r in self._results.items() if a == name)
+            score = sum(r[0] + 0.5 * r[1] for (a, _), r in self._results.items() if a == name)
+            scores[name] = min(max(score, 1e-3 * games), (1 - 1e-3) * games)
+
+        for _ in range(iterations):
+            change = 0.0
+            for name in names:
+                expected = information = 0.0
+                for (a, b), (w, d, l) in self._results.items():
+                    if a != name:
+                        continue
+                    p = 1.0 / (1.0 + 10 ** ((self._ratings[b] - self._ratings[a]) / 400))
+                    expected += (w + d + l) * p
+                    information += (w + d + l) * p * (1 - p)
+                step = (scores[name] - expected) / (scale * max(information, 1e-9))
+                step = min(max(step, -400.0), 400.0)
+                self._ratings[name] += step
+                change = max(change, abs(step))
+            if change < tolerance:
+                break
+
+        # only differences are fitted; the average stays at 1500;
+        if names:
+            mean = sum(self._ratings[n] for n in names) / len(names)
+            for name in names:
+                self._ratings[name] += 1500.0 - mean
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def interval(cls, w, d, l):
+
+        # mean score with a normal confidence interval, and the elo difference
+        # it corresponds to;
+        games = w + d + l
+        score = (w + 0.5 * d) / games
+        variance = (
+            w * (1 - score) ** 2 + d * (0.5 - score) ** 2 + l * score ** 2
+        ) / games
+        margin = cls._z * math.sqrt(variance / games)
+
+        def elo(s):
+            s = min(max(s, 1e-3), 1 - 1e-3)
+            return -400 * math.log10(1 / s - 1) + 0.0
+
+        return score, margin, elo(score), elo(score - margin), elo(score + margin)
+
+    # --------------------------------------------------------------------------
+    def report(self):
+
+        lines = ["%-24s %6s %6s %6s %14s %22s" % ("match", "W", "D", "L", "score", "elo")]
+        for a, b in itertools.combinations(self._names, 2):
+            if (a, b) not in self._results:
+                continue
+            w, d, l = self._results[(a, b)]
+            score, margin, elo, low, high = self.interval(w, d, l)
+            lines.append(
+                "%-24s %6d %6d %6d %7.3f ±%.3f %+7.0f [%+.0f, %+.0f]"
+                % ("%s-%s" % (a, b), w, d, l, score, margin, elo, low, high)
+            )
+
+        lines.append("")
+        lines.append("%-24s %8s %8s" % ("player", "rating", "score"))
+        for name in sorted(self._names, key=lambda n: -self._ratings[n]):
+            w = d = l = 0
+            for (a, _), result in self._results.items():
+                if a == name:
+                    w, d, l = w + result[0], d + result[1], l + result[2]
+            games = w + d + l
+            score = (w + 0.5 * d) / games if games else 0.0
+            lines.append("%-24s %8.0f %8.3f" % (name, self._ratings[name], score))
+
+        return "\n".join(lines)
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+# --------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    roster = [
+        ("random", "random", {}),
+        ("minimax_d2", "minimax", {"in_place": True, "max_depth": 2}),
+        ("minimax_1s", "minimax", {"in_place": True, "time_limit": 1}),
+        ("mcts_200", "mcts", {"playouts": 200}),
+    ]
+
+    t = Tournament(3, 3, 3, roster)
+    t.round_robin(games=20)
+    print(t.report())
+    t.close()
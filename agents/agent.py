@@ -21,3 +21,9 @@ class Agent:
     def end_game(self):
 
         raise Exception("Not implemented.")
+
+    # --------------------------------------------------------------------------
+    def metrics(self):
+
+        # counters of the last step, collected by the engine after every move;
+        return {}
@@ -1,11 +1,35 @@
 
+import concurrent.futures
 import numpy as np
+import threading
 import torch
-import math
 import time
+import os
 
 from agents.agent import Agent
-from tensorboardX import SummaryWriter
+from agents.replay_buffer import ReplayBuffer
+
+
+# checkpoints that were loaded already, by path; agents of the same model share
+# the loaded weights instead of reading the file again;
+_checkpoints = {}
+
+
+# ------------------------------------------------------------------------------
+def load_checkpoint(path):
+
+    # the weights are memory mapped, and only read again once the file changed;
+    # load_state_dict copies them, so sharing them is safe;
+    modified = os.path.getmtime(path)
+    if path not in _checkpoints or _checkpoints[path][0] != modified:
+        try:
+            state_dict = torch.load(path, map_location="cpu", mmap=True)
+        except RuntimeError:
+            # files of the legacy format can't be memory mapped;
+            state_dict = torch.load(path, map_location="cpu")
+        _checkpoints[path] = (modified, state_dict)
+
+    return _checkpoints[path][1]
 
 
 class NN(torch.nn.Module):
@@ -15,14 +39,16 @@ class NN(torch.nn.Module):
     _epsilon_min = .1
 
     # --------------------------------------------------------------------------
-    def __init__(self, state_size, action_size, epsilon=1):
+    def __init__(self, state_size, action_size, epsilon=1, cols=3):
 
         super(NN, self).__init__()
 
         self._epsilon = epsilon
 
+        # actions are flat cells (y * cols + x) of the board;
         self._state_size = state_size
         self._action_size = action_size
+        self._cols = cols
 
         self._fc1 = torch.nn.Linear(self._state_size, 15)
         self._fc2 = torch.nn.Linear(15, 15)
@@ -37,6 +63,9 @@ class NN(torch.nn.Module):
         torch.nn.init.xavier_normal_(self._fc1.weight)
         torch.nn.init.xavier_normal_(self._fc2.weight)
 
+        # guards the weights while a learner publishes new ones;
+        self._lock = threading.Lock()
+
     # --------------------------------------------------------------------------
     def forward(self, x):
 
@@ -51,77 +80,283 @@ class NN(torch.nn.Module):
     # --------------------------------------------------------------------------
     def x_y_to_action(self, x, y):
 
-        return (y*3) + x
+        return (y * self._cols) + x
 
     # --------------------------------------------------------------------------
     def action_to_x_y(self, action):
 
-        x = action % 3
-        y = math.floor(action / 3)
+        x = action % self._cols
+        y = action // self._cols
         return x, y
 
     # --------------------------------------------------------------------------
-    def step(self, state, possible):
+    def mask(self, possible):
+
+        # boolean mask over all actions, set for the possible moves;
+        mask = np.zeros(self._action_size, dtype=bool)
+        if len(possible) > 0:
+            moves = np.asarray(possible)
+            mask[self.x_y_to_action(moves[:, 0], moves[:, 1])] = True
 
-        if self._epsilon > np.random.rand():
+        return mask
 
-            x, y = [-1, -1]
+    # --------------------------------------------------------------------------
+    def step_batch(self, states, masks):
 
-            while [x, y] not in possible:
+        states = np.asarray(states, dtype=np.float32)
+        masks = np.asarray(masks, dtype=bool)
 
-                action = np.random.randint(self._action_size)
-                x, y = self.action_to_x_y(action)
+        # exploring samples pick uniformly from their legal actions, all others
+        # share a single forward pass;
+        prob = masks.astype(np.float64)
+        greedy = self._epsilon <= np.random.rand(len(states))
 
-        else:
+        if greedy.any():
+            with self._lock, torch.no_grad():
+                linear = self.forward(torch.from_numpy(states[greedy]))
+                prob[greedy] *= self._softmax(linear).numpy()
 
-            state = torch.Tensor([state]).float()
-            linear = self.forward(state)
-            prob = self._softmax(linear)[0].detach().numpy()
+        # fall back to a uniform choice if all legal probabilities vanished;
+        total = prob.sum(axis=1, keepdims=True)
+        prob = np.where(total > 0, prob, masks)
+        cumulative = np.cumsum(prob, axis=1)
 
-            for it in range(len(prob)):
+        # sample every row at once; rounding can't pick beyond the last legal
+        # action;
+        r = np.random.rand(len(states), 1) * cumulative[:, -1:]
+        actions = np.count_nonzero(cumulative < r, axis=1)
+        last = self._action_size - 1 - np.argmax(masks[:, ::-1], axis=1)
 
-                x, y = self.action_to_x_y(it)
-                if [x, y] not in possible:
-                    prob[it] = 0
+        return np.minimum(actions, last)
 
-            prob /= np.sum(prob)
-            action = np.random.choice(len(prob), p=prob)
+    # --------------------------------------------------------------------------
+    def publish(self, state_dict):
 
+        # replace the weights, without a forward pass seeing half of them;
+        with self._lock:
+            self.load_state_dict(state_dict)
+
+    # --------------------------------------------------------------------------
+    def step(self, state, possible):
+
+        action = int(self.step_batch([state], [self.mask(possible)])[0])
         x, y = self.action_to_x_y(action)
 
         return x, y, action
 
 
+class InferenceQueue:
+
+    # collects the states of many concurrent games and answers all of them
+    # with a single forward pass of the shared network;
+
+    # --------------------------------------------------------------------------
+    def __init__(self, nn, max_batch=256, max_wait=0.001):
+
+        self._nn = nn
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    # --------------------------------------------------------------------------
+    def submit(self, state, mask):
+
+        # queue a state with its legal action mask; the future resolves to the
+        # chosen action; the flusher starts with the first state, so no caller
+        # waits on a queue that's never flushed;
+        future = concurrent.futures.Future()
+        with self._condition:
+            if self._thread is None:
+                self.start()
+            self._pending.append((state, mask, future))
+            full = len(self._pending) >= self._max_batch
+            self._condition.notify()
+
+        if full:
+            self.flush()
+
+        return future
+
+    # --------------------------------------------------------------------------
+    def flush(self):
+
+        with self._condition:
+            pending = self._pending
+            self._pending = []
+
+        if not pending:
+            return 0
+
+        states, masks, futures = zip(*pending)
+        try:
+            actions = self._nn.step_batch(states, masks)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return 0
+
+        for future, action in zip(futures, actions):
+            future.set_result(int(action))
+
+        return len(pending)
+
+    # --------------------------------------------------------------------------
+    def run(self):
+
+        # flush whenever states are waiting, at most `max_wait` after the first
+        # one came in;
+        while self._running:
+            with self._condition:
+                if not self._pending:
+                    self._condition.wait(self._max_wait)
+            time.sleep(self._max_wait)
+            self.flush()
+
+    # --------------------------------------------------------------------------
+    def start(self):
+
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    # --------------------------------------------------------------------------
+    def stop(self):
+
+        if self._thread is not None:
+            self._running = False
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+class TrainingWorker:
+
+    # trains a copy of the agent's network in a background thread, and
+    # publishes the new weights to the acting network every few rounds;
+
+    # --------------------------------------------------------------------------
+    def __init__(self, agent, publish_every=1):
+
+        self._agent = agent
+        self._publish_every = publish_every
+        self._rounds = 0
+
+        self._nn = NN(agent._nn._state_size, agent._nn._action_size, cols=agent._nn._cols)
+        self._nn.load_state_dict(agent._nn.state_dict())
+
+        self._event = threading.Event()
+        self._running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    # --------------------------------------------------------------------------
+    def trigger(self):
+
+        # start a training round, unless one is running already;
+        self._event.set()
+
+    # --------------------------------------------------------------------------
+    def run(self):
+
+        while True:
+
+            self._event.wait()
+            self._event.clear()
+            if not self._running:
+                break
+
+            self._agent.train(self._nn)
+            self._rounds += 1
+
+            if self._rounds % self._publish_every == 0:
+                self._agent._nn.publish(self._nn.state_dict())
+
+    # --------------------------------------------------------------------------
+    def stop(self):
+
+        self._running = False
+        self._event.set()
+        self._thread.join()
+
+
 class DeepQAgent(Agent):
 
     _trigger_amount = 250
     _batch_size = 64
 
-    _states = []
-    _actions = []
     _reward = 0
     _steps = 0
 
-    _final_states = []
-    _final_actions = []
-    _final_rewards = []
-
     _translation = {79: -1, 88: 1}
 
     # --------------------------------------------------------------------------
     def __init__(self, engine, params):
 
+        # agents of an inference queue play with its network, a checkpoint of
+        # their own would be dropped;
+        if "model_name" in params and params.get("inference") is not None:
+            raise Exception("Load the model into the network of the inference queue.")
+
+        # the action mapping of the network comes from the line table of the
+        # board;
+        board = engine._board
         if "model_name" not in params:
             self._name = str(time.time())
-            self._nn = NN(engine._board._state_size, engine._board._action_size)
+            self._nn = NN(board._state_size, board._action_size, cols=board._lines._cols)
         else:
             self._name = params["model_name"]
-            self._nn = NN(engine._board._state_size, engine._board._action_size, epsilon=.001)
-            state_dict = torch.load("./output/" + self._name + ".model")
-            self._nn.load_state_dict(state_dict)
+            self._nn = NN(
+                board._state_size, board._action_size, epsilon=.001, cols=board._lines._cols
+            )
+            self._nn.load_state_dict(load_checkpoint("./output/" + self._name + ".model"))
             self._name += "_continue"
         self._training_count = 0
-        self._writer = SummaryWriter(logdir="./output/DeepQAgent/" + self._name + "_tb/")
+
+        # games can be augmented with all their symmetric copies;
+        self._engine = engine
+        self._augment = params.get("augment", False)
+        copies = len(engine._board.symmetries()) if self._augment else 1
+
+        # experience is kept in a fixed size ring buffer; by default it holds
+        # at least the games of one training round;
+        state_size = engine._board._state_size
+        capacity = params.get(
+            "replay_capacity", self._trigger_amount * state_size * copies
+        )
+        self._buffer = ReplayBuffer(capacity, state_size)
+        self._games = 0
+
+        # agents of concurrent games can share the network of an inference
+        # queue, which batches their forward passes;
+        self._inference = params.get("inference", None)
+        if self._inference is not None:
+            self._nn = self._inference._nn
+
+        # self-play actors send their finished games to a learner instead of
+        # training on them;
+        self._trajectories = params.get("trajectories", None)
+
+        # evaluated agents only play, they neither keep nor train on games;
+        self._learn = params.get("learn", True)
+
+        # the summary writer is only created with the first training round;
+        self._writer = None
+
+        # training can run in a background thread, so the games never wait for
+        # it; the buffer is shared between both sides;
+        self._lock = threading.Lock()
+        self._worker = None
+        if params.get("async_training", False):
+            self._worker = TrainingWorker(self, params.get("publish_every", 1))
+
+        # timings for the engine's metrics;
+        self._inference_time = None
+        self._training_time = 0.0
 
     # --------------------------------------------------------------------------
     def preprocess_board(self, board):
@@ -145,15 +380,35 @@ class DeepQAgent(Agent):
         # reformat the board;
         board = self.preprocess_board(self._board._board.flatten().tolist())
 
-        # run through the reinforcement agent;
-        x, y, action = self._nn.step(board, possible)
+        # run through the reinforcement agent; the legal actions come straight
+        # from the mask of the board;
+        mask = self._board.possible_mask()
+        start = time.perf_counter()
+        if self._inference is not None:
+            action = self._inference.submit(board, mask).result()
+        else:
+            action = int(self._nn.step_batch([board], [mask])[0])
+        self._inference_time = time.perf_counter() - start
+        x, y = self._nn.action_to_x_y(action)
 
-        self._states.append(board)
-        self._actions.append(action)
-        self._reward += self.get_reward()
+        if self._learn:
+            with self._lock:
+                self._buffer.append(board, action)
+            self._reward += self.get_reward()
 
         return x, y
 
+    # --------------------------------------------------------------------------
+    def metrics(self):
+
+        # training rounds run between games (or in the background), their time
+        # is reported with the next move;
+        training_time, self._training_time = self._training_time, 0.0
+        return {
+            "inference_seconds": self._inference_time,
+            "training_seconds": training_time if training_time else None,
+        }
+
     # --------------------------------------------------------------------------
     def get_reward(self):
 
@@ -169,75 +424,113 @@ class DeepQAgent(Agent):
         return 1
 
     # --------------------------------------------------------------------------
-    def get_best_batches(self, percentile=.8):
+    def train(self, nn):
+
+        # copy the best games out of the buffer, then train without holding on
+        # to it;
+        with self._lock:
+            steps, threshold = self._buffer.select(80)
+            batches = list(self._buffer.batches(steps, self._batch_size))
+            reward = self._buffer.game_rewards().mean()
+
+        losses = []
+        start = time.perf_counter()
+
+        for states, actions in batches:
 
-        states = []
-        actions = []
-        rewards = []
+            x = torch.from_numpy(states)
+            y = torch.from_numpy(actions)
 
-        threshold = np.percentile(self._final_rewards, percentile)
+            nn._opt.zero_grad()
 
-        for it in range(len(self._final_rewards)):
+            y_hat = nn(x)
+            loss = nn._loss(y_hat, y)
 
-            if self._final_rewards[it] < threshold:
-                continue
-            rewards.append(self._final_rewards[it])
+            loss.backward()
+            nn._opt.step()
 
-            for jt in range(len(self._final_states[it])):
+            losses.append(loss.item())
 
-                states.append(self._final_states[it][jt])
-                actions.append(self._final_actions[it][jt])
+        self._training_count += 1
+        self._training_time += time.perf_counter() - start
+        # print("[%d] loss:%3.8f \t threshold:%3.8f" % (self._training_count, loss, threshold))
 
-        return states, actions, rewards, threshold
+        if self._writer is None:
+            from tensorboardX import SummaryWriter
+
+            self._writer = SummaryWriter(logdir="./output/DeepQAgent/" + self._name + "_tb/")
+
+        self._writer.add_scalar("DeepQAgent/loss", np.array(losses).mean(), self._training_count)
+        self._writer.add_scalar("DeepQAgent/threshold", threshold, self._training_count)
+        self._writer.add_scalar("DeepQAgent/reward", reward, self._training_count)
+        self._writer.add_scalar("DeepQAgent/epsilon", self._nn._epsilon, self._training_count)
+
+        torch.save(nn.state_dict(), "./output/" + self._name + ".model")
 
     # --------------------------------------------------------------------------
     def end_game(self):
 
+        if not self._learn:
+            return
+
         self._reward += self.get_reward()
 
-        self._final_states.append(self._states)
-        self._final_actions.append(self._actions)
-        self._final_rewards.append(self._reward)
-        self._states = []
-        self._actions = []
+        if self._trajectories is None:
+            with self._lock:
+                steps = self._buffer.end_game(self._reward)
+                if self._augment:
+                    states = self._buffer._states[steps]
+                    actions = self._buffer._actions[steps]
+                    for game in self.augment(states, actions):
+                        self._buffer.add_game(*game, self._reward)
+            self.finish_game()
+        else:
+            with self._lock:
+                steps = self._buffer.end_game(self._reward)
+                states = self._buffer._states[steps]
+                actions = self._buffer._actions[steps]
+            self._trajectories.put((states, actions, self._reward))
+
         self._reward = 0
         self._steps = 0
 
-        if len(self._final_rewards) >= self._trigger_amount:
-
-            if self._nn._epsilon > self._nn._epsilon_min:
-                self._nn._epsilon *= self._nn._epsilon_decay
-
-            states, actions, rewards, threshold = self.get_best_batches(percentile=80)
-
-            total = math.ceil(len(states) / self._batch_size)
-            losses = []
+    # --------------------------------------------------------------------------
+    def add_game(self, states, actions, reward):
 
-            for it in range(total):
+        # add a game that was played somewhere else, e.g. by a self-play actor;
+        with self._lock:
+            self._buffer.add_game(states, actions, reward)
+            if self._augment:
+                for game in self.augment(states, actions):
+                    self._buffer.add_game(*game, reward)
+        self.finish_game()
 
-                x = torch.Tensor(states[it*self._batch_size:(it+1)*self._batch_size]).float()
-                y = torch.Tensor(actions[it*self._batch_size:(it+1)*self._batch_size]).long()
+    # --------------------------------------------------------------------------
+    def augment(self, states, actions):
 
-                self._nn._opt.zero_grad()
+        # the symmetric copies of a game, besides the game itself; states and
+        # actions are both flat cell indices;
+        games = []
+        for _, cells in self._engine._board.symmetries()[1:]:
+            source = np.argsort(cells)
+            games.append((states[:, source], cells[actions]))
 
-                y_hat = self._nn(x)
-                loss = self._nn._loss(y_hat, y)
+        return games
 
-                loss.backward()
-                self._nn._opt.step()
+    # --------------------------------------------------------------------------
+    def finish_game(self):
 
-                losses.append(loss.item())
+        self._games += 1
 
-            self._training_count += 1
-            # print("[%d] loss:%3.8f \t threshold:%3.8f" % (self._training_count, loss, threshold))
+        if self._games >= self._trigger_amount:
 
-            self._writer.add_scalar("DeepQAgent/loss", np.array(losses).mean(), self._training_count)
-            self._writer.add_scalar("DeepQAgent/threshold", threshold, self._training_count)
-            self._writer.add_scalar("DeepQAgent/reward", np.array(self._final_rewards).mean(), self._training_count)
-            self._writer.add_scalar("DeepQAgent/epsilon", self._nn._epsilon, self._training_count)
+            if self._nn._epsilon > self._nn._epsilon_min:
+                self._nn._epsilon *= self._nn._epsilon_decay
 
-            torch.save(self._nn.state_dict(), "./output/" + self._name + ".model")
+            # hand the round to the background worker, or train right away;
+            if self._worker is not None:
+                self._worker.trigger()
+            else:
+                self.train(self._nn)
 
-            self._final_states = []
-            self._final_actions = []
-            self._final_rewards = []
+            self._games = 0
@@ -0,0 +1,236 @@
+
+import multiprocessing
+import numpy as np
+import math
+import time
+import os
+
+from agents.agent import Agent
+
+
+class Node:
+
+    # --------------------------------------------------------------------------
+    def __init__(self, board, move=None, parent=None, player=None):
+
+        # the move that led to the node, and the player that made it; the
+        # results are kept from that player's perspective;
+        self._move = move
+        self._parent = parent
+        self._player = player
+
+        self._children = {}
+        self._untried = board.possible_moves() if board._started else []
+        self._visits = 0
+        self._wins = 0.0
+
+    # --------------------------------------------------------------------------
+    def select(self, exploration):
+
+        # upper confidence bound for trees;
+        log_visits = math.log(self._visits)
+        best = None
+        best_score = float("-inf")
+
+        for child in self._children.values():
+            score = child._wins / child._visits + exploration * math.sqrt(
+                log_visits / child._visits
+            )
+            if score > best_score:
+                best = child
+                best_score = score
+
+        return best
+
+
+class MCTSAgent(Agent):
+
+    # --------------------------------------------------------------------------
+    def __init__(self, engine, params):
+
+        super().__init__(engine, params)
+
+        # the search runs until the playout budget or the time limit is used
+        # up, whichever comes first;
+        self._playouts = params.get("playouts", None)
+        self._time_limit = params.get("time_limit", None if self._playouts else 5)
+        self._exploration = params.get("exploration", math.sqrt(2))
+
+        # the tree of the last move is reused, if the game went on from there;
+        self._root = None
+        self._root_moves = []
+
+        # root parallel search: every worker process grows its own tree, the
+        # statistics of the root moves are summed up;
+        self._params = params
+        self._workers = params.get("workers", 1)
+        self._pool = None
+        self._searched = 0
+
+    # --------------------------------------------------------------------------
+    def key(self, board, x, y):
+
+        # connect four moves are given by their column;
+        return (x, 0) if board._connect_four else (x, y)
+
+    # --------------------------------------------------------------------------
+    def find_root(self, board):
+
+        # walk the old tree along the moves that were played since, or start a
+        # new one;
+        moves = [(h[0], h[1]) for h in board._history]
+        node = None
+
+        if self._root is not None and moves[: len(self._root_moves)] == self._root_moves:
+            node = self._root
+            for x, y in moves[len(self._root_moves) :]:
+                node = node._children.get(self.key(board, x, y))
+                if node is None:
+                    break
+
+        if node is None:
+            node = Node(board)
+        node._parent = None
+
+        self._root = node
+        self._root_moves = moves
+
+        return node
+
+    # --------------------------------------------------------------------------
+    def playout(self, root, board):
+
+        node = root
+        b = board.c()
+
+        # selection: follow the tree while all moves have been tried;
+        while not node._untried and node._children:
+            node = node.select(self._exploration)
+            b.make_move(list(node._move))
+
+        # expansion: add one untried move;
+        if node._untried:
+            move = node._untried.pop(np.random.randint(0, len(node._untried)))
+            player = b._players[b._player_pointer]
+            b.make_move(move)
+            child = Node(b, tuple(move), node, player)
+            node._children[tuple(move)] = child
+            node = child
+
+        # simulation: random moves until the game ends;
+        while b._started:
+            cells = np.flatnonzero(b.possible_mask())
+            b.make_move(list(b._lines.move(cells[np.random.randint(0, len(cells))])))
+
+        # backpropagation;
+        winner = b._winner
+        while node is not None:
+            node._visits += 1
+            if winner is False:
+                node._wins += 0.5
+            elif winner == node._player:
+                node._wins += 1.0
+            node = node._parent
+
+    # --------------------------------------------------------------------------
+    def search(self, board, deadline=None):
+
+        # grow the tree for the board; returns the statistics of the root moves;
+        # the time limit ends at an absolute deadline, so workers of a parallel
+        # search all stop at the same time, however many tasks they got;
+        board._verbose = False
+        board._incremental = True
+        root = self.find_root(board)
+
+        if deadline is None and self._time_limit is not None:
+            deadline = time.time() + self._time_limit
+        playouts = 0
+
+        while True:
+            if self._playouts is not None and playouts >= self._playouts:
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+            self.playout(root, board)
+            playouts += 1
+
+        return {
+            move: (child._visits, child._wins) for move, child in root._children.items()
+        }
+
+    # --------------------------------------------------------------------------
+    def step(self, possible, time_limit=None):
+
+        # the time limit of the agent can be replaced for a single move;
+        if time_limit is None:
+            time_limit = self._time_limit
+
+        if self._workers <= 1:
+            deadline = None if time_limit is None else time.time() + time_limit
+            stats = self.search(self._board, deadline)
+        else:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(
+                    self._workers, initializer=_init_worker, initargs=(self._params,)
+                )
+            deadline = None if time_limit is None else time.time() + time_limit
+            stats = {}
+            tasks = [(self._board, deadline)] * self._workers
+            for result in self._pool.map(_search, tasks):
+                for move, (visits, wins) in result.items():
+                    total = stats.get(move, (0, 0.0))
+                    stats[move] = (total[0] + visits, total[1] + wins)
+
+        self._searched = sum(visits for visits, _ in stats.values())
+
+        # the most visited move is the most robust choice;
+        if not stats:
+            return possible[np.random.randint(0, len(possible))]
+        move = max(stats, key=lambda m: stats[m][0])
+
+        return list(move)
+
+    # --------------------------------------------------------------------------
+    def metrics(self):
+
+        # playouts of all workers below the root;
+        return {"playouts": self._searched}
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        # shut down the worker processes;
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    # --------------------------------------------------------------------------
+    def end_game(self):
+
+        self._root = None
+        self._root_moves = []
+
+
+# the agent of a worker process, used for root parallel searches;
+_worker = None
+
+
+# ------------------------------------------------------------------------------
+def _init_worker(params):
+
+    global _worker
+    np.random.seed((os.getpid() * 7919 + int(time.time())) % (2 ** 32))
+    params = dict(params)
+    params["workers"] = 1
+    _worker = MCTSAgent(None, params)
+
+
+# ------------------------------------------------------------------------------
+def _search(task):
+
+    # a worker can get more than one task of the same move; a reused tree
+    # would return its visits again, on top of the earlier ones, so every task
+    # starts from a fresh tree; a second task finds the deadline passed;
+    board, deadline = task
+    _worker.end_game()
+    return _worker.search(board, deadline)
@@ -1,14 +1,71 @@
+import multiprocessing
 import numpy as np
 import time
 
 from agents.agent import Agent
+from agents.negamax import Negamax
+from agents.transposition_table import TranspositionTable
+from games.tablebase import Tablebase
 
 
 class MiniMaxAgent(Agent):
 
-    _cache = {}
     _debug = False
 
+    # --------------------------------------------------------------------------
+    def __init__(self, engine, params):
+
+        super().__init__(engine, params)
+
+        # search a single board in place with make/undo instead of copying the
+        # board for every child node;
+        self._in_place = params.get("in_place", False)
+
+        # every agent owns a transposition table of a fixed size (in MB);
+        # symmetric positions can share their entries;
+        self._table = TranspositionTable(params.get("table_size", 16))
+        self._symmetry = params.get("symmetry", False)
+
+        # solved positions are answered straight from a tablebase file;
+        self._tablebase = None
+        if "tablebase" in params:
+            self._tablebase = Tablebase(params["tablebase"])
+
+        # iterative deepening runs up to the depth limit, or until the time per
+        # move runs out; the clock is only checked every so many nodes; the
+        # root is depth 1, so depth 2 (a single ply) is the shallowest search;
+        self._depth_limit = max(2, params.get("max_depth", 8))
+        self._max_depth = self._depth_limit
+        self._time_limit = params.get("time_limit", 30)
+        self._check_every = params.get("check_every", 256)
+        self._enforce = False
+        self._timeout = False
+        self._nodes = 0
+        self._pv = []
+
+        # move ordering heuristics, applied from weakest to strongest: center
+        # first, then the history table, killer moves per ply, the best move
+        # from the table and the principal variation;
+        self._ordering = params.get(
+            "ordering", ("center", "history", "killer", "table", "pv")
+        )
+        self._killers = {}
+        self._history = {}
+        self._cutoffs = 0
+
+        # the search core is either this minimax, or negamax with principal
+        # variation search; negamax searches the board in place, so parallel
+        # root searches (workers > 1) always use minimax;
+        self._search = params.get("search", "minimax")
+        self._negamax = Negamax(self)
+
+        # root moves can be searched by a pool of worker processes, each of them
+        # with its own agent (and table);
+        self._params = params
+        self._workers = params.get("workers", 1)
+        self._pool = None
+        self._search_start = None
+
     # --------------------------------------------------------------------------
     def evaluate(
         self, board, moves=[], depth=1, alpha=float("-inf"), beta=float("inf")
@@ -46,116 +103,181 @@ class MiniMaxAgent(Agent):
         return res, [moves], alpha, beta
 
     # --------------------------------------------------------------------------
-    def evaluate_series(self, ID, checks):
+    def windows(self, board):
+
+        # all windows of `wins` consecutive cells, in every direction, as rows of
+        # flat indices into the board; they come from the line table that all
+        # boards of the same shape share;
+        return board._lines._lines
+
+    # --------------------------------------------------------------------------
+    def estimate(
+        self, board, moves=[], depth=1, alpha=float("-inf"), beta=float("inf")
+    ):
+
+        """
+        Score every window of `wins` cells at once. A window that only holds
+        the agent's symbols (and empty cells) can still be converted into a
+        win and counts positively, one that only holds the opponents' symbols
+        counts negatively, mixed windows are dead and count as 0. Fuller
+        windows weigh more; the result is scaled to [-1, 1], which keeps it
+        well below the values of finished games.
+        """
 
-        # find the longest consecutive occurences of a given ID in the
-        # previously defined check arrays;
+        windows = self.windows(board)
+        if len(windows) == 0:
+            return 0, [moves], alpha, beta
 
-        last_elem = -1
-        series = 0.0
-        longest_series = 0.0
+        cells = board._board.ravel()[windows]
+        own = np.count_nonzero(cells == ord(self._own_symbol), axis=1)
+        other = np.count_nonzero(cells, axis=1) - own
 
-        for row in checks:
-            for elem in row:
-                if elem != last_elem:
-                    last_elem = elem
-                    series = 1.0
-                    continue
-                if elem == last_elem and elem == ID:
-                    series += 1.0
-                if series > longest_series:
-                    longest_series = series
+        score = np.where(other == 0, own * own, 0) - np.where(own == 0, other * other, 0)
+        res = float(score.sum()) / (len(windows) * board._wins * board._wins)
 
-        return longest_series
+        return res, [moves], alpha, beta
 
     # --------------------------------------------------------------------------
-    def estimate_row(self, row):
+    def probe(self, board):
 
-        """
-        GOOD:
-        - if opponent can't win
-        - if agent can win
+        # look the position up, by its canonical form if symmetries are used;
+        # the stored move is mapped back onto the board;
+        if self._symmetry:
+            key, symmetry = board.canonical_hash()
+        else:
+            key, symmetry = board.zobrist_hash(), 0
 
-        BAD:
-        - if opponent can win 
-        - if agent can't win
+        entry = self._table.probe(key)
+        if entry is not None and symmetry:
+            move = board.transform_move(entry[4], symmetry, inverse=True)
+            entry = entry[:4] + (move,)
 
-        target cases:
+        return key, symmetry, entry
 
-        [ X - X - X - ] => can be converted into a win for X            = +1
-        [ O X X X - - ] => can be converted into a win for X            = +1
+    # --------------------------------------------------------------------------
+    def store(self, board, key, symmetry, value, ply, draft, flag, move):
 
-        [ O - O - O - ] => can be converted into a win for O            = -1
-        [ X O O O - -  ] => can be convertedinto a win for O            = -1
+        # moves are stored in the frame of the canonical board;
+        if symmetry:
+            move = board.transform_move(move, symmetry)
+        self._table.store(key, value, ply, draft, flag, move)
 
-        [ X - X O X - ] => can not be converted into a win for X        = 0
-        [ X X X O - - ] => can not be converted into a win for X        = 0
+    # --------------------------------------------------------------------------
+    def order_moves(self, board, possible, moves, depth, best_move=None):
+
+        # sort by the static and the history scores; the sort is stable, so
+        # ties keep the order of the board;
+        keys = []
+        if "center" in self._ordering:
+            rows, cols = board._board.shape
+            keys.append(
+                lambda move: -abs(2 * move[0] - cols + 1)
+                - (0 if board._connect_four else abs(2 * move[1] - rows + 1))
+            )
+        if "history" in self._ordering:
+            keys.insert(0, lambda move: self._history.get(tuple(move), 0))
+        if keys:
+            possible.sort(key=lambda move: [key(move) for key in keys], reverse=True)
+
+        # moves that caused cutoffs at the same ply before come next;
+        if "killer" in self._ordering:
+            for killer in reversed(self._killers.get(depth, [])):
+                if killer in possible:
+                    possible.remove(killer)
+                    possible.insert(0, killer)
+
+        # the best move from the table goes first;
+        if "table" in self._ordering and best_move in possible:
+            possible.remove(best_move)
+            possible.insert(0, best_move)
+
+        # the principal variation of the previous iteration goes before that;
+        pv = self._pv
+        if (
+            "pv" in self._ordering
+            and len(pv) >= depth
+            and moves == pv[: depth - 1]
+            and pv[depth - 1] in possible
+        ):
+            possible.remove(pv[depth - 1])
+            possible.insert(0, pv[depth - 1])
+
+        return possible
 
-        """
+    # --------------------------------------------------------------------------
+    def reset_ordering(self):
 
-        # if row is full, we want to prioritize that outcome over a loss;
-        if len(row[row == 0]) == 0:
-            return 0
-
-        series = 0.0
-        checks = []
-        player = -1
-        opponent = -1
-
-        # prepare all the worst and best case scenarios; the idea is that we
-        # want to evaluate who would have the upper hand if all the free spots
-        # were taken up by only one player;
-        for p in self._board._players:
-            player = ord(p)
-            for o in self._board._players:
-                if o == p:
-                    continue
-                opponent = ord(o)
-                check = np.where(row != player, opponent, player)
-                checks.append(check)
-
-        # evaluate the worst case scenarios;
-        player_series = self.evaluate_series(player, checks)
-        opponent_series = self.evaluate_series(opponent, checks)
-
-        # return which senario is more dominant;
-        if player_series > opponent_series and player_series >= self._board._wins:
-            return player_series / len(checks[0])
-        elif opponent_series >= self._board._wins:
-            return -(opponent_series / len(checks[0]))
-
-        # if they are evenly distributed, we don't want to consider them, but
-        # still prioritize over losses;
-        return 0
+        # killers only make sense for the current search, the history table
+        # fades out over the moves of a game;
+        self._killers = {}
+        for move in self._history:
+            self._history[move] //= 2
 
     # --------------------------------------------------------------------------
-    def estimate(
-        self, board, moves=[], depth=1, alpha=float("-inf"), beta=float("inf")
-    ):
+    def cutoff(self, move, depth):
 
-        # add base board directions;
-        to_check = [board._board, board._board.T]
+        # remember the move that refuted the position, as a killer for its ply
+        # and in the history table, weighted by the remaining depth;
+        self._cutoffs += 1
 
-        # add diagonals to check;
-        for idx in range(-board._width + 1, board._height):
-            to_check.append(board._board.diagonal(idx))
-            to_check.append(np.flipud(board._board).diagonal(idx))
+        killers = self._killers.setdefault(depth, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
 
-        res = 0
+        remaining = self._max_depth - depth
+        self._history[tuple(move)] = (
+            self._history.get(tuple(move), 0) + remaining * remaining
+        )
 
-        # go through boards to check;
-        for bb in to_check:
+    # --------------------------------------------------------------------------
+    def count_node(self):
 
-            # if the board is another array;
-            if isinstance(bb[0], np.ndarray):
+        # count the node and check the clock every so often;
+        self._nodes += 1
+        if self._enforce and self._nodes % self._check_every == 0:
+            if float(time.time()) - self._start_time >= self._cutoff:
+                self._timeout = True
 
-                # go through the rows;
-                for row in bb:
+    # --------------------------------------------------------------------------
+    def lookup(self, board, depth, alpha, beta):
+
+        # look the position up in the transposition table; values are relative
+        # to the root, so they can only be reused at the same ply; the best
+        # move is tried first either way; returns the key and symmetry to store
+        # under, that move, the narrowed window and the value, if the entry
+        # already settles the position;
+        key, symmetry, entry = self.probe(board)
+        best_move = None
+        value = None
+        if entry is not None:
+            stored, ply, entry_draft, flag, best_move = entry
+            if depth > 1 and ply == depth and entry_draft >= self._max_depth - depth:
+                if flag == TranspositionTable.EXACT:
+                    value = stored
+                elif flag == TranspositionTable.LOWER:
+                    alpha = max(alpha, stored)
+                else:
+                    beta = min(beta, stored)
+                if alpha >= beta:
+                    value = stored
 
-                    # and check whether we have a winner;
-                    res += self.estimate_row(row)
+        return key, symmetry, best_move, alpha, beta, value
 
-        return res, [moves], alpha, beta
+    # --------------------------------------------------------------------------
+    def record(self, board, key, symmetry, value, depth, window, best_move):
+
+        # keep the result, unless the time constraint cut the search short; the
+        # bound follows from the window the position was searched with;
+        if self._timeout or best_move is None:
+            return
+        if value <= window[0]:
+            flag = TranspositionTable.UPPER
+        elif value >= window[1]:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.store(board, key, symmetry, value, depth, self._max_depth - depth, flag, best_move)
 
     # --------------------------------------------------------------------------
     def minimax(
@@ -177,6 +299,8 @@ class MiniMaxAgent(Agent):
         possible = board.possible_moves()
         mm = moves[:]
 
+        self.count_node()
+
         # if the board is in an end state, evaluate the result;
         if not board._started:
             res, mov, alpha, beta = self.evaluate(
@@ -188,7 +312,7 @@ class MiniMaxAgent(Agent):
 
         # if the tree is at a maximum depth, we estimate the outcome with the
         # previously defined function;
-        if depth >= 8:
+        if depth >= self._max_depth:
             res, mov, alpha, beta = self.estimate(
                 board, mm, depth + 1, alpha=alpha, beta=beta
             )
@@ -196,6 +320,12 @@ class MiniMaxAgent(Agent):
                 print(" " * depth, str(depth) + ":", " == RETURN", res)
             return res, mov, alpha, beta
 
+        key, symmetry, best_move, alpha, beta, value = self.lookup(board, depth, alpha, beta)
+        if value is not None:
+            return value, [mm], alpha, beta
+        window = (alpha, beta)
+        self.order_moves(board, possible, mm, depth, best_move)
+
         # tracker is used both for the min, as well as the max result
         tracker = float("-inf") if maxx else float("inf")
 
@@ -206,28 +336,20 @@ class MiniMaxAgent(Agent):
         # consider all possible moves;
         for move in possible:
 
-            # if we are at a deep level, consider the time constraint and exit
-            # the tree with the current information;
-            if depth > 1:
-                total_stop = float(time.time()) - self._start_time >= self._cutoff
-                branch_stop = (
-                    float(time.time()) - self._branch_start_time >= self._branch_cutoff
-                )
-                if total_stop or branch_stop:
-                    break
+            # once the time is up, exit the tree; the unfinished iteration is
+            # discarded by the caller;
+            if self._timeout:
+                break
 
-            # copy the board and make the move;
-            nb = board.c()
+            # copy the board and make the move; in place, the move is taken
+            # back after the recursion;
+            nb = board if self._in_place else board.c()
             check = nb.make_move(move)
 
             # if the move failed, move on to the next one;
             if not check:
                 continue
 
-            # create the start time for this branch
-            if depth == 1:
-                self._branch_start_time = float(time.time())
-
             # call the recursion;
             res, mov, _, _ = self.minimax(
                 nb,
@@ -237,6 +359,8 @@ class MiniMaxAgent(Agent):
                 alpha=alpha,
                 beta=beta,
             )
+            if self._in_place:
+                nb.undo_move()
 
             # only use if it's not working correctly;
             if self._debug:
@@ -250,9 +374,11 @@ class MiniMaxAgent(Agent):
                     if res > tracker:
                         tracker = res
                         movements = mov
+                        best_move = move
                     if tracker >= beta:
                         if self._debug:
                             print(" " * depth, str(depth) + ":", "BREAK")
+                        self.cutoff(move, depth)
                         break
                     if tracker > alpha:
                         alpha = tracker
@@ -266,15 +392,21 @@ class MiniMaxAgent(Agent):
                 if res < tracker:
                     tracker = res
                     movements = mov
+                    best_move = move
                 if tracker <= alpha:
                     if self._debug:
                         print(" " * depth, str(depth) + ":", "BREAK")
+                    self.cutoff(move, depth)
                     break
                 if tracker < beta:
                     beta = tracker
                     if self._debug:
                         print(" " * depth, str(depth) + ":", "new beta", beta)
 
+        # the root keeps all results, it's stored by the caller;
+        if depth > 1:
+            self.record(board, key, symmetry, tracker, depth, window, best_move)
+
         # return
         if self._debug:
             print(" " * depth, str(depth) + ":", "RETURN", tracker if depth > 1 else results)
@@ -283,42 +415,206 @@ class MiniMaxAgent(Agent):
         return results, movements, alpha, beta
 
     # --------------------------------------------------------------------------
-    def step(self, possible, time_limit=30, use_prob=False):
+    def search_root(self):
 
-        # create placeholders for the time constraints;
-        self._start_time = float(time.time())
-        self._cutoff = time_limit - 2
-        self._branch_cutoff = time_limit / len(possible)
+        # the root collects the results of all moves, which are independent of
+        # each other; they can be searched sequentially or in parallel;
+        if self._workers <= 1:
+            results, movements, _, _ = self.minimax(
+                self._board, moves=[], depth=1, maxx=True
+            )
+            return results, movements
 
-        # own symbol to check against in evaluations;
-        self._own_symbol = self._board._players[self._board._player_pointer]
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self._workers, initializer=_init_worker, initargs=(self._params,)
+            )
+
+        state = (
+            self._own_symbol,
+            self._max_depth,
+            self._start_time,
+            self._cutoff,
+            self._enforce,
+            self._pv,
+        )
+        # keep the same move order as the sequential search;
+        possible = self._board.possible_moves()
+        _, _, entry = self.probe(self._board)
+        self.order_moves(
+            self._board, possible, [], 1, entry[4] if entry is not None else None
+        )
+        tasks = [(self._board, move, state) for move in possible]
+
+        results = []
+        movements = []
+        for res, mov, nodes, cutoffs, timeout, distribution, wins in self._pool.map(
+            _search_root_move, tasks
+        ):
+            results.append(res)
+            movements.extend(mov)
+            self._nodes += nodes
+            self._cutoffs += cutoffs
+            self._timeout = self._timeout or timeout
+            self._prob_distribution += distribution
+            self._total_wins += wins
+
+        return results, movements
 
-        # hashing and probability distribution initialization;
-        hhash = self._board._board.tostring()
-        self._prob_distribution = np.zeros_like(self._board._board)
+    # --------------------------------------------------------------------------
+    def search_root_move(self, board, move, state):
+
+        # pick up the search state of the agent that sent the move;
+        (
+            self._own_symbol,
+            self._max_depth,
+            self._start_time,
+            self._cutoff,
+            self._enforce,
+            self._pv,
+        ) = state
+        if self._search_start != self._start_time:
+            self._search_start = self._start_time
+            self._table.new_search()
+            self.reset_ordering()
+        self._timeout = False
+        self._nodes = 0
+        self._cutoffs = 0
+        self._prob_distribution = np.zeros_like(board._board)
         self._total_wins = 0.0
 
-        # check whether the move has already been cached
-        if hhash in self._cache:
+        # search the move as the first level below the root;
+        self.set_board(board)
+        nb = board.c()
+        nb.make_move(move)
+        res, mov, _, _ = self.minimax(nb, moves=[move], depth=2, maxx=False)
+
+        return (
+            res,
+            mov,
+            self._nodes,
+            self._cutoffs,
+            self._timeout,
+            self._prob_distribution,
+            self._total_wins,
+        )
 
-            # if so return it from cache
-            results, movements, alpha, beta = self._cache[hhash]
+    # --------------------------------------------------------------------------
+    def close(self):
 
-        else:
+        # shut down the worker processes;
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
 
-            results, movements, alpha, beta = self.minimax(
-                self._board, moves=[], depth=1, maxx=True
+    # --------------------------------------------------------------------------
+    def iterative_deepening(self):
+
+        # search one ply deeper per iteration and keep the results of the last
+        # iteration that finished; the first iteration always runs to the end,
+        # so there is always a move to return;
+        completed = None
+        last_duration = None
+        self._pv = []
+
+        for max_depth in range(2, self._depth_limit + 1):
+
+            iteration_start = float(time.time())
+            self._max_depth = max_depth
+            self._enforce = completed is not None
+            self._timeout = False
+            self._prob_distribution = np.zeros_like(self._board._board)
+            self._total_wins = 0.0
+
+            if self._search == "negamax" and self._workers <= 1:
+                results, movements = self._negamax.search_root()
+            else:
+                results, movements = self.search_root()
+            if self._timeout:
+                break
+
+            completed = (
+                results,
+                movements,
+                self._prob_distribution,
+                self._total_wins,
+                max_depth,
             )
+            self._pv = movements[int(np.argmax(results))]
+
+            # every line ends before the depth limit; deeper searches would
+            # return the same results;
+            if max_depth - 1 >= self._board._empty:
+                completed = completed[:-1] + (self._depth_limit,)
+                break
+
+            # don't start an iteration that is not going to finish in time,
+            # assuming it grows like the last one did;
+            now = float(time.time())
+            duration = now - iteration_start
+            growth = duration / last_duration if last_duration else 1.0
+            if now - self._start_time + duration * growth >= self._cutoff:
+                break
+            last_duration = duration
+
+        self._max_depth = self._depth_limit
+        self._enforce = False
+        self._timeout = False
+
+        return completed
+
+    # --------------------------------------------------------------------------
+    def step(self, possible, time_limit=None, use_prob=False):
+
+        # create placeholders for the time constraints; keep a small margin of
+        # the time limit for the rest of the turn;
+        if time_limit is None:
+            time_limit = self._time_limit
+        self._start_time = float(time.time())
+        self._cutoff = time_limit - min(2, time_limit * 0.1)
+        self._nodes = 0
+        self._cutoffs = 0
+        self._reached = 0
+        self._table_hits = self._table._hits
+        self._table_probes = self._table._probes
+        self.reset_ordering()
 
-            # results containing inf or -inf have not been considered, we have
-            # to remove them for the implementation to work; this is usually
-            # caused by the time constraint;
-            rr = []
-            for res in results:
-                if res == float("inf") or res == float("-inf"):
-                    continue
-                rr.append(res)
-            results = rr
+        # own symbol to check against in evaluations;
+        self._own_symbol = self._board._players[self._board._player_pointer]
+
+        # a solved position needs no search;
+        if self._tablebase is not None:
+            entry = self._tablebase.probe(self._board)
+            if entry is not None and entry[2] in possible:
+                return entry[2]
+
+        # hashing initialization;
+        self._table.new_search()
+
+        # check whether the root decision has already been searched to full
+        # depth;
+        key, symmetry, entry = self.probe(self._board)
+        if (
+            entry is not None
+            and entry[1] == 1
+            and entry[2] >= self._depth_limit - 1
+            and entry[3] == TranspositionTable.EXACT
+        ):
+
+            # if so return it from the table
+            results, movements = [entry[0]], [[entry[4]]]
+            self._reached = entry[2] + 1
+
+        else:
+
+            (
+                results,
+                movements,
+                self._prob_distribution,
+                self._total_wins,
+                reached,
+            ) = self.iterative_deepening()
+            self._reached = reached
 
             if self._debug:
                 print("ORIGINAL", results, movements)
@@ -336,18 +632,60 @@ class MiniMaxAgent(Agent):
                 arg = np.argmax(results)
 
             print("AGENT DECISIONS", perc if use_prob else results, movements)
+            if self._debug:
+                print("NODES SEARCHED", self._nodes, "CUTOFFS", self._cutoffs)
 
             # set the final results and movements;
             results = [results[arg]]
             movements = [movements[arg]]
 
-            # add result to cache;
-            self._cache[hhash] = (results, movements, alpha, beta)
+            # add the decision to the table;
+            self.store(
+                self._board,
+                key,
+                symmetry,
+                results[0],
+                1,
+                reached - 1,
+                TranspositionTable.EXACT,
+                movements[0][0],
+            )
 
         # print("Minimax decision: %4.4f using => " % results[0], movements[0], "alpha:%4.4f, beta:%4.4f" % (alpha, beta))
         return movements[0][0]
 
+    # --------------------------------------------------------------------------
+    def metrics(self):
+
+        # the table counters of the workers stay in their processes;
+        return {
+            "nodes": self._nodes,
+            "cutoffs": self._cutoffs,
+            "depth": self._reached,
+            "table_probes": self._table._probes - self._table_probes,
+            "table_hits": self._table._hits - self._table_hits,
+        }
+
     # --------------------------------------------------------------------------
     def end_game(self):
 
         pass
+
+
+# the agent of a worker process, used for parallel root searches;
+_worker = None
+
+
+# ------------------------------------------------------------------------------
+def _init_worker(params):
+
+    global _worker
+    params = dict(params)
+    params["workers"] = 1
+    _worker = MiniMaxAgent(None, params)
+
+
+# ------------------------------------------------------------------------------
+def _search_root_move(task):
+
+    return _worker.search_root_move(*task)
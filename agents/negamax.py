@@ -0,0 +1,114 @@
+class Negamax:
+
+    # negamax with principal variation search and aspiration windows; it
+    # shares the table, move ordering, evaluation and time management of the
+    # agent that owns it, but always scores positions from the perspective of
+    # the player to move and searches the agent's board in place;
+
+    _window = 0.25
+    _null = 1e-6
+
+    # --------------------------------------------------------------------------
+    def __init__(self, agent):
+
+        self._agent = agent
+        self._value = 0.0
+
+    # --------------------------------------------------------------------------
+    def score(self, board, depth):
+
+        # a finished game was won by the player that moved last; faster wins
+        # are worth more, faster losses less;
+        if board._winner:
+            return -(100.0 + 1.0 / depth)
+        if board._winner is False:
+            return 0.0
+
+        # the estimate is made for the agent, flip it for the opponent;
+        res, _, _, _ = self._agent.estimate(board)
+        if board._players[board._player_pointer] != self._agent._own_symbol:
+            res = -res
+
+        return res
+
+    # --------------------------------------------------------------------------
+    def search(self, board, depth, alpha, beta, moves):
+
+        agent = self._agent
+
+        agent.count_node()
+        if not board._started or depth >= agent._max_depth:
+            return self.score(board, depth), []
+
+        key, symmetry, best_move, alpha, beta, value = agent.lookup(board, depth, alpha, beta)
+        if value is not None:
+            return value, [best_move]
+
+        possible = agent.order_moves(board, board.possible_moves(), moves, depth, best_move)
+        window = (alpha, beta)
+        best = float("-inf")
+        pv = []
+
+        for it, move in enumerate(possible):
+
+            # once the time is up, exit the tree; the unfinished iteration is
+            # discarded by the caller;
+            if agent._timeout:
+                break
+
+            board.make_move(move)
+
+            # the first move gets the full window; all others are only proven
+            # to be worse with a null window, and searched again if they're not;
+            if it == 0:
+                score, line = self.search(board, depth + 1, -beta, -alpha, moves + [move])
+            else:
+                score, line = self.search(
+                    board, depth + 1, -alpha - self._null, -alpha, moves + [move]
+                )
+                if alpha < -score < beta:
+                    score, line = self.search(
+                        board, depth + 1, -beta, -alpha, moves + [move]
+                    )
+            score = -score
+
+            board.undo_move()
+
+            if score > best:
+                best = score
+                best_move = move
+                pv = [move] + line
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                agent.cutoff(move, depth)
+                break
+
+        agent.record(board, key, symmetry, best, depth, window, best_move)
+
+        return best, pv
+
+    # --------------------------------------------------------------------------
+    def search_root(self):
+
+        # the first iteration searches the full window, all later ones start
+        # with a narrow window around the last value and widen it on failure;
+        agent = self._agent
+        alpha, beta = float("-inf"), float("inf")
+        if agent._enforce:
+            alpha, beta = self._value - self._window, self._value + self._window
+
+        while True:
+            value, pv = self.search(agent._board, 1, alpha, beta, [])
+            if agent._timeout:
+                break
+            if value <= alpha:
+                alpha = float("-inf")
+            elif value >= beta:
+                beta = float("inf")
+            else:
+                break
+
+        self._value = value
+
+        return [value], [pv]
@@ -9,6 +9,13 @@ class RandomAgent(Agent):
     # --------------------------------------------------------------------------
     def step(self, possible):
 
-        # pick a random move from all possible ones;
-        move = possible[np.random.randint(0, len(possible))]
-        return move
+        # pick a random move from all possible ones, straight from the mask of
+        # the board;
+        cells = np.flatnonzero(self._board.possible_mask())
+        x, y = self._board._lines.move(cells[np.random.randint(0, len(cells))])
+        return [int(x), int(y)]
+
+    # --------------------------------------------------------------------------
+    def end_game(self):
+
+        pass
@@ -0,0 +1,124 @@
+
+import numpy as np
+
+
+class ReplayBuffer:
+
+    # --------------------------------------------------------------------------
+    def __init__(self, capacity, state_size):
+
+        # all steps live in preallocated arrays that are written as a ring; once
+        # the buffer is full, the oldest steps are overwritten;
+        self._capacity = capacity
+        self._states = np.zeros((capacity, state_size), dtype=np.float32)
+        self._actions = np.zeros(capacity, dtype=np.int64)
+
+        # every step carries the final reward of its game; the first step of a
+        # game is flagged, and steps of unfinished games are not done yet;
+        self._rewards = np.zeros(capacity, dtype=np.float64)
+        self._starts = np.zeros(capacity, dtype=bool)
+        self._done = np.zeros(capacity, dtype=bool)
+
+        self._position = 0
+        self._size = 0
+        self._game_start = 0
+        self._game_length = 0
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+
+        return self._size
+
+    # --------------------------------------------------------------------------
+    def append(self, state, action):
+
+        # add a step of the current game;
+        it = self._position
+        self._states[it] = state
+        self._actions[it] = action
+        self._rewards[it] = 0
+        self._starts[it] = self._game_length == 0
+        self._done[it] = False
+
+        if self._game_length == 0:
+            self._game_start = it
+        self._game_length += 1
+
+        self._position = (it + 1) % self._capacity
+        self._size = min(self._size + 1, self._capacity)
+
+    # --------------------------------------------------------------------------
+    def add_game(self, states, actions, reward):
+
+        # add all steps of a finished game at once;
+        length = min(len(actions), self._capacity)
+        if length == 0:
+            return
+
+        steps = (self._position + np.arange(length)) % self._capacity
+        self._states[steps] = states[-length:]
+        self._actions[steps] = actions[-length:]
+        self._rewards[steps] = reward
+        self._starts[steps] = False
+        self._starts[steps[0]] = True
+        self._done[steps] = True
+
+        self._position = (self._position + length) % self._capacity
+        self._size = min(self._size + length, self._capacity)
+
+    # --------------------------------------------------------------------------
+    def end_game(self, reward):
+
+        # hand the final reward to all steps of the game that are still in the
+        # buffer; returns the positions of these steps;
+        length = min(self._game_length, self._capacity)
+        if length > 0:
+            steps = (self._position - length + np.arange(length)) % self._capacity
+            self._rewards[steps] = reward
+            self._starts[steps[0]] = True
+            self._done[steps] = True
+        else:
+            steps = np.zeros(0, dtype=np.int64)
+
+        self._game_length = 0
+
+        return steps
+
+    # --------------------------------------------------------------------------
+    def game_rewards(self):
+
+        # the rewards of all finished games that still start in the buffer;
+        return self._rewards[self._starts & self._done]
+
+    # --------------------------------------------------------------------------
+    def select(self, percentile):
+
+        # the steps of all games that reached the reward percentile;
+        rewards = self.game_rewards()
+        if len(rewards) == 0:
+            return np.zeros(0, dtype=np.int64), 0.0
+
+        threshold = np.percentile(rewards, percentile)
+        steps = np.flatnonzero(self._done & (self._rewards >= threshold))
+
+        return steps, threshold
+
+    # --------------------------------------------------------------------------
+    def batches(self, steps, batch_size):
+
+        # shuffled minibatches over the given steps;
+        steps = np.random.permutation(steps)
+        for it in range(0, len(steps), batch_size):
+            batch = steps[it : it + batch_size]
+            yield self._states[batch], self._actions[batch]
+
+    # --------------------------------------------------------------------------
+    def sample(self, batch_size, percentile=0):
+
+        # a random minibatch of the games that reached the reward percentile;
+        steps, _ = self.select(percentile)
+        if len(steps) == 0:
+            return self._states[:0], self._actions[:0]
+        batch = steps[np.random.randint(0, len(steps), size=batch_size)]
+
+        return self._states[batch], self._actions[batch]
@@ -0,0 +1,86 @@
+
+import numpy as np
+
+
+class TranspositionTable:
+
+    # bound types of the stored values;
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    # bytes used by a single entry (key, value, ply, draft, flag, age, move);
+    _entry_size = 8 + 8 + 2 + 2 + 1 + 2 + 2 + 2
+
+    # --------------------------------------------------------------------------
+    def __init__(self, megabytes=16):
+
+        # the table never grows past its initial allocation; every key maps to
+        # exactly one slot;
+        self._slots = max(1, int(megabytes * 1024 * 1024) // self._entry_size)
+
+        self._keys = np.full(self._slots, -1, dtype=np.int64)
+        self._values = np.zeros(self._slots, dtype=np.float64)
+        self._plies = np.zeros(self._slots, dtype=np.int16)
+        self._drafts = np.zeros(self._slots, dtype=np.int16)
+        self._flags = np.zeros(self._slots, dtype=np.int8)
+        self._ages = np.zeros(self._slots, dtype=np.int16)
+        self._moves = np.zeros((self._slots, 2), dtype=np.int16)
+
+        self._age = 0
+        self._hits = 0
+        self._probes = 0
+
+    # --------------------------------------------------------------------------
+    def new_search(self):
+
+        # entries of older searches are the first to be replaced;
+        self._age = (self._age + 1) % np.iinfo(np.int16).max
+
+    # --------------------------------------------------------------------------
+    def clear(self):
+
+        self._keys[:] = -1
+        self._age = 0
+        self._hits = 0
+        self._probes = 0
+
+    # --------------------------------------------------------------------------
+    def probe(self, key):
+
+        # returns (value, ply, draft, flag, move) or None;
+        self._probes += 1
+        slot = key % self._slots
+        if self._keys[slot] != key:
+            return None
+
+        self._hits += 1
+        return (
+            float(self._values[slot]),
+            int(self._plies[slot]),
+            int(self._drafts[slot]),
+            int(self._flags[slot]),
+            [int(self._moves[slot][0]), int(self._moves[slot][1])],
+        )
+
+    # --------------------------------------------------------------------------
+    def store(self, key, value, ply, draft, flag, move):
+
+        slot = key % self._slots
+
+        # keep deeper entries of the current search, replace everything else;
+        if (
+            self._keys[slot] != -1
+            and self._keys[slot] != key
+            and self._ages[slot] == self._age
+            and self._drafts[slot] > draft
+        ):
+            return
+
+        self._keys[slot] = key
+        self._values[slot] = value
+        self._plies[slot] = ply
+        self._drafts[slot] = draft
+        self._flags[slot] = flag
+        self._ages[slot] = self._age
+        self._moves[slot] = move
@@ -0,0 +1,163 @@
+
+import numpy as np
+
+from games.lines import Lines
+
+
+class BatchBoard:
+
+    _verbose = True
+
+    # --------------------------------------------------------------------------
+    def __init__(self, games, width, height, wins, connect_four=False, auto_reset=True):
+
+        # initialize game parameters; they are the same as for a single board,
+        # but every array gets a leading dimension for the games;
+        self._games = games
+        self._width = width
+        self._height = height
+        self._wins = wins
+        self._connect_four = connect_four
+        self._auto_reset = auto_reset
+        self._state_size = width * height
+        self._action_size = self._state_size
+
+        self._players = []
+        self._codes = np.zeros(0, dtype=np.int64)
+        self._started = False
+
+        # initialize the boards; moves are flat cell indices (y * cols + x),
+        # for connect four only the column of the index is used;
+        self._board = np.zeros((games, width, height), dtype=np.int64)
+        self._rows, self._cols = self._board.shape[1:]
+        self._player_pointer = np.zeros(games, dtype=np.int64)
+        self._winner = np.full(games, -1, dtype=np.int64)
+        self._finished = np.zeros(games, dtype=bool)
+        self._index = np.arange(games)
+
+    # --------------------------------------------------------------------------
+    def windows(self):
+
+        # all windows of `wins` consecutive cells as rows of flat indices; they
+        # are shared with every board of the same shape;
+        return Lines.get(self._rows, self._cols, self._wins)._lines
+
+    # --------------------------------------------------------------------------
+    def add_player(self, symbol):
+
+        # do not allow new players after the games have started;
+        if self._started:
+            if self._verbose:
+                print("[ERROR] Game already started.")
+            return
+
+        self._players.append(symbol)
+        self._codes = np.array([ord(p) for p in self._players], dtype=np.int64)
+
+    # --------------------------------------------------------------------------
+    def reset(self, games=None):
+
+        # reset all games, or only the selected ones;
+        if games is None:
+            games = self._index
+
+        self._board[games] = 0
+        self._winner[games] = -1
+        self._finished[games] = False
+        self._player_pointer[games] = np.random.randint(
+            0, len(self._players), size=len(self._index[games])
+        )
+
+    # --------------------------------------------------------------------------
+    def start_game(self):
+
+        # check the amount of players;
+        if len(self._players) < 2:
+            if self._verbose:
+                print("[ERROR] Not enough players in the game.")
+            return False
+
+        self.reset()
+        self._started = True
+
+        return True
+
+    # --------------------------------------------------------------------------
+    def possible_moves(self):
+
+        # boolean mask of shape (games, rows * cols); for connect four only the
+        # top cell of every open column is marked, just like the single board
+        # returns [x, 0];
+        empty = self._board == 0
+        if self._connect_four:
+            mask = np.zeros_like(empty)
+            mask[:, 0, :] = empty[:, 0, :]
+            empty = mask
+        empty[self._finished] = False
+
+        return empty.reshape(self._games, -1)
+
+    # --------------------------------------------------------------------------
+    def make_moves(self, actions):
+
+        # plays one move in every game; returns which moves were legal, and for
+        # every game that ended the index of the winning player (-1 for draws);
+        actions = np.asarray(actions, dtype=np.int64)
+        x = actions % self._cols
+        y = actions // self._cols
+
+        legal = (actions >= 0) & (actions < self._state_size) & ~self._finished
+        x = np.where(legal, x, 0)
+        y = np.where(legal, y, 0)
+
+        # drop the pieces to the lowest free cell of their column;
+        if self._connect_four:
+            columns = self._board[self._index, :, x] == 0
+            legal &= columns.any(axis=1)
+            y = self._rows - 1 - np.argmax(columns[:, ::-1], axis=1)
+        else:
+            legal &= self._board[self._index, y, x] == 0
+
+        games = self._index[legal]
+        pointer = self._player_pointer[games]
+        self._board[games, y[legal], x[legal]] = self._codes[pointer]
+
+        # check the windows of the games that moved for the mover's symbol;
+        cells = self._board.reshape(self._games, -1)[games][:, self.windows()]
+        won = np.all(cells == self._codes[pointer][:, None, None], axis=2).any(axis=1)
+        full = ~(self._board[games] == 0).reshape(len(games), -1).any(axis=1)
+
+        self._winner[games[won]] = pointer[won]
+        self._finished[games[won | full]] = True
+
+        # let the next player make the next move;
+        self._player_pointer[games] = (pointer + 1) % len(self._players)
+
+        finished = self._finished.copy()
+        winner = self._winner.copy()
+
+        # start new games in place of the finished ones;
+        if self._auto_reset and finished.any():
+            self.reset(self._index[finished])
+
+        return legal, finished, winner
+
+
+if __name__ == "__main__":
+
+    import time
+
+    b = BatchBoard(4096, 6, 7, 4, connect_four=True)
+    b._verbose = False
+    b.add_player("O")
+    b.add_player("X")
+    b.start_game()
+
+    start = time.time()
+    games = 0
+    for _ in range(1000):
+        mask = b.possible_moves()
+        actions = np.argmax(np.random.rand(*mask.shape) * mask, axis=1)
+        _, finished, _ = b.make_moves(actions)
+        games += np.count_nonzero(finished)
+    print("%d games in %3.2f seconds" % (games, time.time() - start))
@@ -0,0 +1,136 @@
+
+from games.connect_four import Board
+
+
+class BitBoard(Board):
+
+    # the board keeps one integer mask per player next to the regular numpy
+    # board; cells are laid out column by column with one spare sentinel bit
+    # on top of every column, so shifting a mask never wraps into a
+    # neighbouring column:
+    #
+    #   bit = x * (rows + 1) + y
+    #
+    # with shifts of 1 (vertical), rows + 1 (horizontal), rows and rows + 2
+    # (both diagonals);
+
+    _layouts = {}
+
+    # --------------------------------------------------------------------------
+    def __init__(self, width, height, wins, connect_four=False, incremental=False):
+
+        super().__init__(
+            width, height, wins, connect_four=connect_four, incremental=incremental
+        )
+
+        rows, cols = self._board.shape
+        self._stride = rows + 1
+        self._shifts = (1, self._stride, self._stride - 1, self._stride + 1)
+
+        # precompute the cells in the same (row-major) order as the regular
+        # board emits its moves, together with their bits; they only depend
+        # on the board shape, so they are shared by all boards (and copies);
+        name = (rows, cols)
+        if name not in self._layouts:
+            cells = [(x, y, 1 << self.bit(x, y)) for y in range(rows) for x in range(cols)]
+            top = [(x, 1 << self.bit(x, 0)) for x in range(cols)]
+            full = 0
+            for _, _, bit in cells:
+                full |= bit
+            self._layouts[name] = (cells, top, full)
+        self._cells, self._top, self._full = self._layouts[name]
+
+        self._masks = {}
+        self._occupied = 0
+
+    # --------------------------------------------------------------------------
+    def bit(self, x, y):
+
+        return x * self._stride + y
+
+    # --------------------------------------------------------------------------
+    def reset(self):
+
+        super().reset()
+        self._masks = {}
+        self._occupied = 0
+
+    # --------------------------------------------------------------------------
+    def c(self):
+
+        b = super().c()
+        b._masks = dict(self._masks)
+        b._occupied = self._occupied
+
+        return b
+
+    # --------------------------------------------------------------------------
+    def possible_moves(self):
+
+        empty = self._full & ~self._occupied
+
+        # connect four only needs the top cell of every column to be free;
+        if self._connect_four:
+            return [[x, 0] for x, bit in self._top if empty & bit]
+
+        return [[x, y] for x, y, bit in self._cells if empty & bit]
+
+    # --------------------------------------------------------------------------
+    def _set_cell(self, x, y, symbol):
+
+        super()._set_cell(x, y, symbol)
+
+        bit = 1 << self.bit(x, y)
+        self._masks[symbol] = self._masks.get(symbol, 0) | bit
+        self._occupied |= bit
+
+    # --------------------------------------------------------------------------
+    def _clear_cell(self, x, y):
+
+        symbol = chr(self._board[y][x])
+        super()._clear_cell(x, y)
+
+        bit = 1 << self.bit(x, y)
+        self._masks[symbol] &= ~bit
+        self._occupied &= ~bit
+
+    # --------------------------------------------------------------------------
+    def check_mask(self, mask):
+
+        # shift-and-and the mask along every direction; after `wins - 1`
+        # rounds only the starting bits of complete sequences remain;
+        for shift in self._shifts:
+            m = mask
+            for _ in range(self._wins - 1):
+                m &= m >> shift
+                if not m:
+                    break
+            if m:
+                return True
+
+        return False
+
+    # --------------------------------------------------------------------------
+    def check_winning_state(self):
+
+        if self._occupied == self._full:
+            self._started = False
+
+        for symbol in self._players:
+            if self.check_mask(self._masks.get(symbol, 0)):
+                return symbol
+
+        return False
+
+    # --------------------------------------------------------------------------
+    def check_last_move(self, x, y):
+
+        if self._occupied == self._full:
+            self._started = False
+
+        # only the mask of the player that just moved can have changed;
+        symbol = chr(self._board[y][x])
+        if self.check_mask(self._masks[symbol]):
+            return symbol
+
+        return False
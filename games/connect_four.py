@@ -1,7 +1,10 @@
 
 import numpy as np
+import random
 import copy
 
+from games.lines import Lines
+
 
 class Board:
 
@@ -11,20 +14,50 @@ class Board:
     _player_pointer = 0
     _verbose = True
     _winner = None
+    _zobrist = {}
+    _symmetries = {}
+
+    # the coordinate transforms of the board: identity, the mirrors and the
+    # half turn work on every board, the quarter turns and transpositions only
+    # on square ones; their inverses are listed alongside;
+    _transforms = [
+        lambda x, y, r, c: (x, y),
+        lambda x, y, r, c: (c - 1 - x, y),
+        lambda x, y, r, c: (x, r - 1 - y),
+        lambda x, y, r, c: (c - 1 - x, r - 1 - y),
+        lambda x, y, r, c: (y, x),
+        lambda x, y, r, c: (r - 1 - y, x),
+        lambda x, y, r, c: (y, c - 1 - x),
+        lambda x, y, r, c: (r - 1 - y, c - 1 - x),
+    ]
+    _inverse = [0, 1, 2, 3, 4, 6, 5, 7]
 
     # --------------------------------------------------------------------------
-    def __init__(self, width, height, wins, connect_four=False):
+    def __init__(self, width, height, wins, connect_four=False, incremental=False):
 
         # initialize game parameters;
         self._width = width
         self._height = height
         self._wins = wins
         self._connect_four = connect_four
+        self._incremental = incremental
         self._state_size = width * height
         self._action_size = self._state_size
 
         # initialize the board;
+        self._players = []
         self._board = np.zeros((self._width, self._height), dtype=np.int64)
+        self._empty = self._state_size
+        self._history = []
+        self._hashes = [0] * len(self.symmetries())
+
+        # only the hash of the board itself is kept up to date on every move;
+        # the hashes of the symmetric boards are added once they're needed;
+        self._symmetric = False
+
+        # all winning lines of the board shape, shared with every other board
+        # (and agent) of the same configuration;
+        self._lines = Lines.get(self._width, self._height, self._wins)
 
     # --------------------------------------------------------------------------
     def reset(self):
@@ -32,6 +65,9 @@ class Board:
         self._winner = None
         self._started = False
         self._board = np.zeros((self._width, self._height), dtype=np.int64)
+        self._empty = self._state_size
+        self._history = []
+        self._hashes = [0] * len(self.symmetries())
 
         # TODO: randomize starting player
         self._player_pointer = np.random.randint(0, len(self._players))
@@ -41,8 +77,18 @@ class Board:
     def c(self):
 
         # only copy elements that are neccessary;
-        b = Board(self._width, self._height, self._wins, connect_four=self._connect_four)
+        b = type(self)(
+            self._width,
+            self._height,
+            self._wins,
+            connect_four=self._connect_four,
+            incremental=self._incremental,
+        )
         b._board = copy.deepcopy(self._board)
+        b._empty = self._empty
+        b._history = self._history[:]
+        b._hashes = self._hashes[:]
+        b._symmetric = self._symmetric
         b._players = self._players[:]
         b._started = self._started
         b._player_pointer = self._player_pointer
@@ -71,23 +117,28 @@ class Board:
             print("Added player '%s'." % symbol)
 
     # --------------------------------------------------------------------------
-    def possible_moves(self):
-
-        moves = []
+    def possible_mask(self):
 
-        # return the current moves that are possible; 2D for tic tac toe
+        # boolean mask over the flat cells (y * cols + x) of the possible moves;
+        # every cell for tic tac toe, the top cells of the open columns for
+        # connect four;
         if not self._connect_four:
-            for it in range(self._board.shape[0]):
-                for jt in range(self._board.shape[1]):
-                    if self._board[it][jt] == 0:
-                        moves.append([jt, it])
-        # and 1D for connect four;
-        else:
-            board_t = self._board.T
-            for it in range(len(board_t)):
-                if board_t[it][0] == 0: moves.append([it, 0])
+            return self._board.ravel() == 0
+
+        mask = np.zeros(self._board.size, dtype=bool)
+        mask[: self._board.shape[1]] = self._board[0] == 0
 
-        return moves
+        return mask
+
+    # --------------------------------------------------------------------------
+    def possible_moves(self):
+
+        # return the current moves that are possible as [x, y] lists, in row
+        # major order; 2D for tic tac toe and 1D ([x, 0]) for connect four;
+        cols = self._board.shape[1]
+        cells = np.flatnonzero(self.possible_mask())
+
+        return [list(move) for move in zip((cells % cols).tolist(), (cells // cols).tolist())]
 
     # --------------------------------------------------------------------------
     def make_move(self, move, change_player=True):
@@ -133,8 +184,11 @@ class Board:
         # get the symbol;
         symbol = self._players[self._player_pointer]
 
+        # remember everything that is needed to take the move back;
+        self._history.append((x, y, self._player_pointer, self._winner, self._started))
+
         # add symbol to board;
-        self._board[y][x] = ord(symbol)
+        self._set_cell(x, y, symbol)
 
         # let the next player make the next move;
         if change_player:
@@ -142,8 +196,12 @@ class Board:
         if self._player_pointer >= len(self._players):
             self._player_pointer = 0
         
-        # check if the game is over;
-        winner = self.check_winning_state()
+        # check if the game is over; the incremental mode only looks at the
+        # lines through the cell that was just played;
+        if self._incremental:
+            winner = self.check_last_move(x, y)
+        else:
+            winner = self.check_winning_state()
         if winner:
             self._winner = winner
             if self._verbose:
@@ -157,74 +215,210 @@ class Board:
         return True
 
     # --------------------------------------------------------------------------
-    def check_row(self, row):
+    def undo_move(self):
 
-        series = 0
-        last_elem = -1
-
-        # go through columns in row and find sequences that determine the
-        # winning streak; streaks of 0s do not count;
-        for elem in row:
-
-            # a new element other than 0 found, begins the series;
-            if elem != last_elem and elem != 0:
-                last_elem = elem
-                series = 1
-            # the element is the same as the last, series continues;
-            elif elem == last_elem and elem != 0:
-                series += 1
-            # reset the series otherwise;
-            else:
-                series = 0
+        # nothing to take back;
+        if not self._history:
+            if self._verbose:
+                print("[ERROR] No move to undo.")
+            return False
 
-            # if the series is the amount required to win, we found a winner;
-            if series >= self._wins:
-                return chr(last_elem), series
+        # restore the state from before the last move;
+        x, y, pointer, winner, started = self._history.pop()
+        self._clear_cell(x, y)
+        self._player_pointer = pointer
+        self._winner = winner
+        self._started = started
 
-        # no winner on current board;
-        return False, series
+        return True
 
     # --------------------------------------------------------------------------
-    def check_winning_state(self):
+    def _set_cell(self, x, y, symbol):
 
-        if len(self._board[self._board == 0]) == 0:
-            self._started = False
+        # place the symbol on the board; subclasses hook in here to keep their
+        # own representations in sync;
+        self._board[y][x] = ord(symbol)
+        self._empty -= 1
+        self.update_hashes(x, y, symbol)
 
-        # add base board directions;
-        to_check = [self._board, self._board.T]
+    # --------------------------------------------------------------------------
+    def _clear_cell(self, x, y):
 
-        # add diagonals to check;
-        for idx in range(-self._width+1, self._height):
-            to_check.append(self._board.diagonal(idx))
-            to_check.append(np.flipud(self._board).diagonal(idx))
+        # remove the symbol from the board again;
+        self.update_hashes(x, y, chr(self._board[y][x]))
+        self._board[y][x] = 0
+        self._empty += 1
 
-        # go through boards to check;
-        for bb in to_check:
+    # --------------------------------------------------------------------------
+    def zobrist_keys(self, symbol):
 
-            # if the board is another array;
-            if isinstance(bb[0], np.ndarray):
+        # random 63 bit keys per cell and symbol; they are seeded by the board
+        # shape and the symbol, so every board of the same shape (and every
+        # process) agrees on them;
+        rows, cols = self._board.shape
+        name = (rows, cols, symbol)
+        if name not in self._zobrist:
+            rng = random.Random("%d:%d:%s" % name)
+            self._zobrist[name] = [
+                [rng.getrandbits(63) for _ in range(cols)] for _ in range(rows)
+            ]
 
-                # go through the rows;
-                for row in bb:
+        return self._zobrist[name]
+
+    # --------------------------------------------------------------------------
+    def turn_key(self):
 
-                    # and check whether we have a winner;
-                    winner, _ = self.check_row(row)
-                    if winner:
-                        return winner
+        # the key of the symbol whose turn it is; keyed by the symbol rather
+        # than its position in the player list, so boards (and tablebases)
+        # agree on positions no matter in which order the players were added;
+        rows, cols = self._board.shape
+        name = (rows, cols, "turn", self._players[self._player_pointer])
+        if name not in self._zobrist:
+            rng = random.Random("%d:%d:%s:%s" % name)
+            self._zobrist[name] = rng.getrandbits(63)
 
-            # otherwise we are checking a diagonal (which is returned by numpy as
-            # a 1D array);
+        return self._zobrist[name]
+
+    # --------------------------------------------------------------------------
+    def zobrist_hash(self):
+
+        # the board hash, combined with the player whose turn it is;
+        return self._hashes[0] ^ self.turn_key()
+
+    # --------------------------------------------------------------------------
+    def symmetries(self):
+
+        # forward maps of the flat cell indices (y * cols + x) for every
+        # transform that maps the board onto itself; connect four only allows
+        # the left-right mirror, since gravity breaks all others;
+        rows, cols = self._board.shape
+        name = (rows, cols, self._connect_four)
+
+        if name not in self._symmetries:
+            if self._connect_four:
+                transforms = [0, 1]
+            elif rows == cols:
+                transforms = list(range(8))
             else:
+                transforms = [0, 1, 2, 3]
 
-                # else the board is a row;
-                row = bb
-                # find the winner from there;
-                winner, series = self.check_row(row)
-                if winner:
-                    return winner
+            maps = []
+            for t in transforms:
+                cells = np.zeros(rows * cols, dtype=np.int64)
+                for y in range(rows):
+                    for x in range(cols):
+                        tx, ty = self._transforms[t](x, y, rows, cols)
+                        cells[y * cols + x] = ty * cols + tx
+                maps.append((t, cells))
+            self._symmetries[name] = maps
+
+        return self._symmetries[name]
+
+    # --------------------------------------------------------------------------
+    def update_hashes(self, x, y, symbol):
+
+        # toggle the symbol in the hash of the board, and in the hashes of all
+        # symmetric boards once they're used;
+        keys = self.zobrist_keys(symbol)
+        if not self._symmetric:
+            self._hashes[0] ^= keys[y][x]
+            return
+
+        rows, cols = self._board.shape
+        for it, (t, _) in enumerate(self.symmetries()):
+            tx, ty = self._transforms[t](x, y, rows, cols)
+            self._hashes[it] ^= keys[ty][tx]
+
+    # --------------------------------------------------------------------------
+    def enable_symmetries(self):
+
+        # compute the hashes of all symmetric boards from the current board,
+        # and keep them up to date from now on;
+        self._hashes = [0] * len(self.symmetries())
+        self._symmetric = True
+        for y, x in np.argwhere(self._board != 0).tolist():
+            self.update_hashes(x, y, chr(self._board[y][x]))
+
+    # --------------------------------------------------------------------------
+    def transform_move(self, move, symmetry, inverse=False):
+
+        # map a move into the frame of the symmetry (by its position in
+        # `symmetries`), or back from it;
+        rows, cols = self._board.shape
+        t = self.symmetries()[symmetry][0]
+        if inverse:
+            t = self._inverse[t]
+        x, y = self._transforms[t](move[0], move[1], rows, cols)
+
+        return [x, y]
+
+    # --------------------------------------------------------------------------
+    def canonical_hash(self):
+
+        # the smallest hash of all symmetric boards identifies the position;
+        # returns it (with the player to move) and the symmetry that leads to
+        # it;
+        if not self._symmetric:
+            self.enable_symmetries()
+        symmetry = int(np.argmin(self._hashes))
+
+        return self._hashes[symmetry] ^ self.turn_key(), symmetry
+
+    # --------------------------------------------------------------------------
+    def canonical(self):
+
+        # the canonical board, and the symmetry that leads to it;
+        _, symmetry = self.canonical_hash()
+        cells = self.symmetries()[symmetry][1]
+        board = np.zeros(self._board.size, dtype=self._board.dtype)
+        board[cells] = self._board.ravel()
+
+        return board.reshape(self._board.shape), symmetry
+
+    # --------------------------------------------------------------------------
+    def count_direction(self, x, y, dx, dy):
+
+        rows, cols = self._board.shape
+        elem = self._board[y][x]
+        series = 0
+
+        # walk away from the cell as long as the symbol stays the same;
+        x, y = x + dx, y + dy
+        while 0 <= x < cols and 0 <= y < rows and self._board[y][x] == elem:
+            series += 1
+            x, y = x + dx, y + dy
+
+        return series
+
+    # --------------------------------------------------------------------------
+    def check_last_move(self, x, y):
+
+        if self._empty == 0:
+            self._started = False
+
+        # only the four lines through the last move can contain a new winning
+        # sequence; walking them is faster than a lookup of the line table for
+        # a single cell;
+        for dx, dy in ((1, 0), (0, 1), (1, 1), (1, -1)):
+            series = 1
+            series += self.count_direction(x, y, dx, dy)
+            series += self.count_direction(x, y, -dx, -dy)
+            if series >= self._wins:
+                return chr(self._board[y][x])
 
         return False
 
+    # --------------------------------------------------------------------------
+    def check_winning_state(self):
+
+        if len(self._board[self._board == 0]) == 0:
+            self._started = False
+
+        # look for a line that is filled by a single symbol;
+        code = self._lines.winner(self._board.ravel())
+
+        return chr(code) if code else False
+
     # --------------------------------------------------------------------------
     def start_game(self):
 
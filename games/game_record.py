@@ -0,0 +1,185 @@
+
+import numpy as np
+import os
+
+from games.connect_four import Board
+
+
+class GameRecord:
+
+    # a record file starts with a 16 byte header:
+    #
+    #   b"GREC", version, width, height, wins, connect_four, players,
+    #   the player symbols (up to 6 bytes, zero padded)
+    #
+    # followed by one fixed size record per game:
+    #
+    #   result (0 for a draw, else the index of the winner + 1), the index of
+    #   the starting player, the amount of moves, and the flat cells
+    #   (y * cols + x) of all moves, padded with 255
+    #
+    # fixed sizes let the whole file be memory mapped as a 2D array;
+
+    _magic = b"GREC"
+    _version = 1
+    _header_size = 16
+    _padding = 255
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def header(cls, board):
+
+        if board._state_size >= cls._padding or len(board._players) > 6:
+            raise Exception("Board too large for game records.")
+
+        header = bytearray(cls._header_size)
+        header[:4] = cls._magic
+        header[4:10] = bytes(
+            [
+                cls._version,
+                board._width,
+                board._height,
+                board._wins,
+                int(board._connect_four),
+                len(board._players),
+            ]
+        )
+        header[10 : 10 + len(board._players)] = bytes(ord(p) for p in board._players)
+
+        return bytes(header)
+
+
+class GameRecordWriter(GameRecord):
+
+    # --------------------------------------------------------------------------
+    def __init__(self, path, board, buffer_size=256):
+
+        # new files get a header, existing ones are appended to;
+        self._header = self.header(board)
+        self._record_size = 3 + board._state_size
+        self._buffer_size = buffer_size
+        self._pending = []
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, "rb") as f:
+                if f.read(self._header_size) != self._header:
+                    raise Exception("Game record of a different board configuration.")
+        self._file = open(path, "ab")
+        if not exists:
+            self._file.write(self._header)
+
+    # --------------------------------------------------------------------------
+    def write(self, board):
+
+        # add the finished game of the board;
+        record = np.full(self._record_size, self._padding, dtype=np.uint8)
+        cols = board._board.shape[1]
+
+        if board._winner:
+            record[0] = board._players.index(board._winner) + 1
+        else:
+            record[0] = 0
+        record[1] = board._history[0][2] if board._history else board._player_pointer
+        record[2] = len(board._history)
+        for it, (x, y, _, _, _) in enumerate(board._history):
+            record[3 + it] = y * cols + x
+
+        self._pending.append(record.tobytes())
+        if len(self._pending) >= self._buffer_size:
+            self.flush()
+
+    # --------------------------------------------------------------------------
+    def flush(self):
+
+        self._file.write(b"".join(self._pending))
+        self._file.flush()
+        self._pending = []
+
+    # --------------------------------------------------------------------------
+    def close(self):
+
+        self.flush()
+        self._file.close()
+
+
+class GameRecordReader(GameRecord):
+
+    # --------------------------------------------------------------------------
+    def __init__(self, path):
+
+        with open(path, "rb") as f:
+            header = f.read(self._header_size)
+        if header[:4] != self._magic:
+            raise Exception("Not a game record file.")
+
+        (
+            _,
+            self._width,
+            self._height,
+            self._wins,
+            connect_four,
+            players,
+        ) = header[4:10]
+        self._connect_four = bool(connect_four)
+        self._players = [chr(c) for c in header[10 : 10 + players]]
+
+        # map all records; an incomplete trailing record is ignored;
+        self._record_size = 3 + self._width * self._height
+        size = os.path.getsize(path) - self._header_size
+        count = size // self._record_size
+        if count > 0:
+            self._records = np.memmap(
+                path,
+                dtype=np.uint8,
+                mode="r",
+                offset=self._header_size,
+                shape=(count, self._record_size),
+            )
+        else:
+            self._records = np.zeros((0, self._record_size), dtype=np.uint8)
+
+        # column views over all games;
+        self._results = self._records[:, 0]
+        self._starts = self._records[:, 1]
+        self._lengths = self._records[:, 2]
+        self._moves = self._records[:, 3:]
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+
+        return len(self._records)
+
+    # --------------------------------------------------------------------------
+    def __getitem__(self, index):
+
+        # (winner symbol or False for a draw, starting symbol, [x, y] moves);
+        # the numpy board is (width, height), so a row has height cells;
+        record = self._records[index]
+        cols = self._height
+        result = self._players[record[0] - 1] if record[0] else False
+        cells = record[3 : 3 + record[2]].astype(np.int64)
+
+        return (
+            result,
+            self._players[record[1]],
+            [[int(c % cols), int(c // cols)] for c in cells],
+        )
+
+    # --------------------------------------------------------------------------
+    def replay(self, index):
+
+        # rebuild the final board of a game;
+        _, start, moves = self[index]
+
+        board = Board(self._width, self._height, self._wins, connect_four=self._connect_four)
+        board._verbose = False
+        for player in self._players:
+            board.add_player(player)
+        board.start_game()
+        board._player_pointer = self._players.index(start)
+
+        for move in moves:
+            board.make_move(move)
+
+        return board
@@ -0,0 +1,61 @@
+
+import numpy as np
+
+
+class Lines:
+
+    # every line of `wins` consecutive cells on a board, in all four
+    # directions, as rows of flat cell indices (y * cols + x); they only
+    # depend on the board shape, so they are computed once per shape and
+    # shared by all boards and agents;
+    _cache = {}
+
+    # --------------------------------------------------------------------------
+    def __init__(self, rows, cols, wins):
+
+        self._rows = rows
+        self._cols = cols
+        self._wins = wins
+        self._cells = rows * cols
+
+        lines = []
+        for dx, dy in ((1, 0), (0, 1), (1, 1), (1, -1)):
+            for y in range(rows):
+                for x in range(cols):
+                    end_x = x + dx * (wins - 1)
+                    end_y = y + dy * (wins - 1)
+                    if 0 <= end_x < cols and 0 <= end_y < rows:
+                        lines.append([(y + dy * it) * cols + x + dx * it for it in range(wins)])
+        self._lines = np.array(lines, dtype=np.int64).reshape(-1, wins)
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def get(cls, rows, cols, wins):
+
+        name = (rows, cols, wins)
+        if name not in cls._cache:
+            cls._cache[name] = cls(rows, cols, wins)
+
+        return cls._cache[name]
+
+    # --------------------------------------------------------------------------
+    def cell(self, x, y):
+
+        # the flat index of a move; works on arrays of moves as well;
+        return y * self._cols + x
+
+    # --------------------------------------------------------------------------
+    def move(self, cell):
+
+        # the (x, y) of a flat index; works on arrays of cells as well;
+        return cell % self._cols, cell // self._cols
+
+    # --------------------------------------------------------------------------
+    def winner(self, cells, lines=None):
+
+        # the code of the symbol that fills a whole line of the flat board, or
+        # 0; only the given line table is checked, if any;
+        values = cells[self._lines if lines is None else lines]
+        won = (values[:, 0] != 0) & (values.min(axis=1) == values.max(axis=1))
+
+        return int(values[won.argmax(), 0]) if won.any() else 0
@@ -0,0 +1,190 @@
+
+import numpy as np
+import sys
+import os
+
+from games.bit_board import BitBoard
+
+
+class Tablebase:
+
+    # solved positions, stored as an open addressing hash table of canonical
+    # position keys; the file is memory mapped, so a lookup only touches the
+    # few slots it probes; the keys don't tell boards of different wins or
+    # gravity apart, so the file starts with a 16 byte header:
+    #
+    #   b"TBAS", version, width, height, wins, connect_four, players,
+    #   the player symbols (up to 6 bytes, zero padded)
+    #
+    _magic = b"TBAS"
+    _version = 1
+    _header_size = 16
+    _dtype = np.dtype(
+        [("key", np.int64), ("value", np.int8), ("plies", np.int8), ("move", np.int16)]
+    )
+
+    # --------------------------------------------------------------------------
+    def __init__(self, path):
+
+        with open(path, "rb") as f:
+            self._header = f.read(self._header_size)
+        if self._header[:4] != self._magic:
+            raise Exception("Not a tablebase file.")
+
+        count = (os.path.getsize(path) - self._header_size) // self._dtype.itemsize
+        self._table = np.memmap(
+            path, dtype=self._dtype, mode="r", offset=self._header_size, shape=(count,)
+        )
+        self._mask = len(self._table) - 1
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def header(cls, width, height, wins, connect_four, symbols):
+
+        header = bytearray(cls._header_size)
+        header[:4] = cls._magic
+        header[4:10] = bytes(
+            [cls._version, width, height, wins, int(connect_four), len(symbols)]
+        )
+        header[10 : 10 + len(symbols)] = bytes(ord(s) for s in symbols)
+
+        return bytes(header)
+
+    # --------------------------------------------------------------------------
+    def check(self, board):
+
+        # a table only answers boards of its own configuration;
+        header = self.header(
+            board._width, board._height, board._wins, board._connect_four, board._players
+        )
+        if header != self._header:
+            raise Exception("Tablebase of a different board configuration.")
+
+    # --------------------------------------------------------------------------
+    @staticmethod
+    def path(width, height, wins, connect_four=False, directory="./output/"):
+
+        # the default file of a board configuration;
+        return directory + "tablebase_%dx%d_%d%s.tb" % (
+            width,
+            height,
+            wins,
+            "_c4" if connect_four else "",
+        )
+
+    # --------------------------------------------------------------------------
+    def probe(self, board):
+
+        # returns (value, plies, move) for the player to move, or None; the
+        # value is 1 for a win, 0 for a draw and -1 for a loss, reached after
+        # the given amount of plies with perfect play;
+        self.check(board)
+        key, symmetry = board.canonical_hash()
+        slot = key & self._mask
+
+        while True:
+            entry = self._table[slot]
+            if entry["key"] == -1:
+                return None
+            if entry["key"] == key:
+                break
+            slot = (slot + 1) & self._mask
+
+        # moves are stored as flat cells of the canonical board;
+        cols = board._board.shape[1]
+        move = [int(entry["move"]) % cols, int(entry["move"]) // cols]
+        move = board.transform_move(move, symmetry, inverse=True)
+
+        return int(entry["value"]), int(entry["plies"]), move
+
+    # --------------------------------------------------------------------------
+    @classmethod
+    def write(cls, solved, path, header):
+
+        # at most half of the slots are used, so probes stay short;
+        size = 1
+        while size < 2 * len(solved):
+            size *= 2
+        mask = size - 1
+
+        table = np.zeros(size, dtype=cls._dtype)
+        table["key"] = -1
+
+        for key, (value, plies, move) in solved.items():
+            slot = key & mask
+            while table["key"][slot] != -1:
+                slot = (slot + 1) & mask
+            table[slot] = (key, value, plies, move)
+
+        with open(path, "wb") as f:
+            f.write(header)
+            f.write(table.tobytes())
+
+
+# ------------------------------------------------------------------------------
+def solve(width, height, wins, connect_four=False, symbols=("X", "O")):
+
+    # exhaustive negamax over all positions that can be reached from the empty
+    # board with either player starting; positions are merged by symmetry;
+    board = BitBoard(width, height, wins, connect_four=connect_four, incremental=True)
+    board._verbose = False
+    for symbol in symbols:
+        board.add_player(symbol)
+
+    cols = board._board.shape[1]
+    solved = {}
+
+    def negamax():
+
+        key, symmetry = board.canonical_hash()
+        if key in solved:
+            return solved[key]
+
+        best = None
+        best_score = None
+        best_move = None
+
+        for move in board.possible_moves():
+
+            board.make_move(move)
+            if board._winner:
+                value, plies = 1, 1
+            elif board._winner is False:
+                value, plies = 0, 1
+            else:
+                value, plies, _ = negamax()
+                value, plies = -value, plies + 1
+            board.undo_move()
+
+            # prefer fast wins, then draws, then slow losses;
+            score = value * (1000 - plies) if value else 0
+            if best_score is None or score > best_score:
+                best = (value, plies)
+                best_score = score
+                best_move = move
+
+        # the move is stored in the frame of the canonical board;
+        x, y = board.transform_move(best_move, symmetry)
+        solved[key] = best + (y * cols + x,)
+
+        return solved[key]
+
+    for pointer in range(len(symbols)):
+        board.start_game()
+        board._player_pointer = pointer
+        negamax()
+
+    return solved
+
+
+if __name__ == "__main__":
+
+    # python -m games.tablebase <width> <height> <wins> [c4]
+    width, height, wins = [int(arg) for arg in sys.argv[1:4]]
+    connect_four = len(sys.argv) > 4 and sys.argv[4] == "c4"
+
+    solved = solve(width, height, wins, connect_four=connect_four)
+    path = Tablebase.path(width, height, wins, connect_four=connect_four)
+    header = Tablebase.header(width, height, wins, connect_four, ("X", "O"))
+    Tablebase.write(solved, path, header)
+    print("Solved %d positions into '%s'." % (len(solved), path))